@@ -0,0 +1,266 @@
+"""
+Pooled sound effects
+
+arcade.play_sound() makes a new pyglet player every time it is called, so
+a row of coins collected in one tick starts a burst of players at once.
+Here every effect gets a fixed set of players, its voices, made when the
+sound is added. Playing takes a free voice, or restarts the one that has
+been playing longest. All the requests for one sound in a frame are mixed
+into a single play, a little louder for each extra request, and a sound
+never restarts more often than its min_interval.
+
+Decoding happens on an audio thread, so the game loop never waits for a
+WAV file. Sounds are decoded the first time they are played, or earlier,
+while the audio thread has nothing else to do, if they were added with
+preload. The voices are made and played on the main thread: pyglet isn't
+thread safe, and it runs its players' events on the main event loop.
+"""
+import collections
+import glob
+import os
+import queue
+import threading
+import time
+
+import arcade
+import pyglet.media
+
+# Players made for each sound effect
+VOICES_PER_SOUND = 4
+
+# Shortest time, in seconds, between two plays of the same sound
+MIN_REPEAT_INTERVAL = 0.05
+
+# Volume of a single play. Below full, so bursts have room to be louder.
+SOUND_VOLUME = 0.8
+
+# Volume added for each extra request mixed into one play
+BURST_VOLUME_STEP = 0.15
+
+MAX_VOLUME = 1.0
+
+
+class SoundPool:
+    """ One sound effect with its own preloaded voices. """
+
+    def __init__(self, sound, voices=VOICES_PER_SOUND, min_interval=MIN_REPEAT_INTERVAL,
+                 volume=SOUND_VOLUME):
+        self.sound = sound
+        self.min_interval = min_interval
+        self.volume = volume
+
+        self.voices = [pyglet.media.Player() for _ in range(voices)]
+
+        # Voices in the order they were last started, oldest first
+        self.started = collections.deque(self.voices)
+        self.last_play_time = None
+
+        self.play_count = 0
+        self.merged_count = 0
+        self.rate_limited_count = 0
+        self.stolen_count = 0
+
+    def play(self, requests=1, now=None):
+        """ Play once for all the requests made since the last call. """
+        if now is None:
+            now = time.perf_counter()
+        self.merged_count += requests - 1
+
+        if self.last_play_time is not None and now - self.last_play_time < self.min_interval:
+            self.rate_limited_count += 1
+            return None
+        self.last_play_time = now
+
+        voice = self.free_voice()
+        if voice is None:
+            # Steal the voice that has been playing longest, from the start
+            voice = self.started[0]
+            voice.pause()
+            voice.seek(0.0)
+            self.stolen_count += 1
+        else:
+            voice.queue(self.sound.source)
+
+        voice.volume = min(self.volume + BURST_VOLUME_STEP * (requests - 1), MAX_VOLUME)
+        voice.play()
+
+        self.started.remove(voice)
+        self.started.append(voice)
+        self.play_count += 1
+        return voice
+
+    def free_voice(self):
+        """ A voice that has finished playing, or None if they are all busy. """
+        for voice in self.started:
+            if voice.source is None:
+                return voice
+        return None
+
+    def delete(self):
+        """ Release the voices. """
+        for voice in self.voices:
+            voice.delete()
+        self.voices = []
+        self.started.clear()
+
+
+class AudioManager:
+    """
+    The game's sound effects, by name. Decoded on an audio thread, played
+    on the main thread.
+    """
+
+    def __init__(self):
+        # name -> (file name, voices, min_interval, volume), for every sound added
+        self.sounds = {}
+
+        # name -> SoundPool, for the sounds decoded so far. Main thread only.
+        self.pools = {}
+
+        # Commands for the audio thread: (action, name), or None to stop.
+        # SimpleQueue is the C queue without task tracking, so a put never blocks.
+        self.commands = queue.SimpleQueue()
+
+        # (name, arcade.Sound, or None if it couldn't be decoded) back from the audio thread
+        self.decoded = queue.SimpleQueue()
+
+        # Sounds that couldn't be decoded. Main thread only.
+        self.failed = set()
+
+        # name -> (requests, time) of plays asked for before the sound was decoded
+        self.waiting = {}
+
+        # Sounds to decode while the audio thread is idle, and the ones it has
+        # decoded already. Audio thread only.
+        self.pending_loads = collections.deque()
+        self.loaded = set()
+
+        self.decode_count = 0
+        self.decode_time = 0.0
+        self.error_count = 0
+
+        self.thread = threading.Thread(target=self.run, name="audio", daemon=True)
+        self.thread.start()
+
+    def add_sound(self, name, file_name, voices=VOICES_PER_SOUND,
+                  min_interval=MIN_REPEAT_INTERVAL, volume=SOUND_VOLUME, preload=False):
+        """
+        Add a sound without decoding it. It is decoded on the audio thread
+        when first played, or in the background straight away with preload.
+        """
+        if name in self.sounds:
+            raise ValueError(f"There is already a sound named '{name}'.")
+        self.sounds[name] = (file_name, voices, min_interval, volume)
+        if preload:
+            self.commands.put(("preload", name))
+
+    def add_directory(self, directory, voices=VOICES_PER_SOUND):
+        """ Add every .wav file in a directory, named after the file. Nothing is decoded. """
+        for file_name in sorted(glob.glob(os.path.join(directory, "*.wav"))):
+            name = os.path.splitext(os.path.basename(file_name))[0]
+            if name not in self.sounds:
+                self.add_sound(name, file_name, voices)
+
+    def play_events(self, sound_names, now=None):
+        """
+        Play a batch of sound requests, one play per distinct sound. Call
+        every frame from the main thread, even with no requests, so sounds
+        that finished decoding get their voices.
+        """
+        self.take_decoded()
+        if not sound_names:
+            return
+        if now is None:
+            now = time.perf_counter()
+        for name, requests in collections.Counter(sound_names).items():
+            if name not in self.sounds:
+                raise KeyError(f"No sound named '{name}'.")
+            pool = self.pools.get(name)
+            if pool is not None:
+                pool.play(requests, now)
+            elif name not in self.failed:
+                # Played once it's decoded, as one play for everything asked for until then.
+                # The audio thread decodes it ahead of any preloads.
+                if name not in self.waiting:
+                    self.commands.put(("load", name))
+                waiting_requests, first_time = self.waiting.get(name, (0, now))
+                self.waiting[name] = (waiting_requests + requests, first_time)
+
+    def take_decoded(self):
+        """
+        Make the voices of the sounds the audio thread has decoded. Main
+        thread only: pyglet players aren't thread safe, and their events
+        arrive on the main thread's event loop.
+        """
+        while True:
+            try:
+                name, sound = self.decoded.get_nowait()
+            except queue.Empty:
+                return
+            if sound is None:
+                self.failed.add(name)
+                self.waiting.pop(name, None)
+                continue
+            file_name, voices, min_interval, volume = self.sounds[name]
+            pool = SoundPool(sound, voices, min_interval, volume)
+            self.pools[name] = pool
+            waiting = self.waiting.pop(name, None)
+            if waiting is not None:
+                pool.play(*waiting)
+
+    def run(self):
+        """ The audio thread: decode sounds asked for, and preloads when there are none. """
+        while True:
+            if self.pending_loads:
+                try:
+                    command = self.commands.get_nowait()
+                except queue.Empty:
+                    self.decode(self.pending_loads.popleft())
+                    continue
+            else:
+                command = self.commands.get()
+
+            if command is None:
+                return
+            action, name = command
+            if action == "preload":
+                self.pending_loads.append(name)
+            elif action == "load":
+                if name in self.pending_loads:
+                    self.pending_loads.remove(name)
+                self.decode(name)
+
+    def decode(self, name):
+        """ Decode a sound, unless it has been already, and hand it to the main thread. """
+        if name in self.loaded:
+            return
+        self.loaded.add(name)
+        file_name = self.sounds[name][0]
+        start_time = time.perf_counter()
+        try:
+            sound = arcade.load_sound(file_name)
+        except Exception as error:
+            # Logged and skipped, so one bad file doesn't stop the audio thread
+            print(f"Warning, couldn't decode sound '{name}': {error}")
+            self.error_count += 1
+            sound = None
+        else:
+            self.decode_time += time.perf_counter() - start_time
+            self.decode_count += 1
+        self.decoded.put((name, sound))
+
+    def report(self):
+        """ One line of play counts, for the profiler overlay. """
+        counts = ", ".join(f"{name} {pool.play_count}/{pool.merged_count}"
+                           f"/{pool.rate_limited_count}/{pool.stolen_count}"
+                           for name, pool in self.pools.items())
+        return (f"sounds played/merged/limited/stolen: {counts}; "
+                f"{self.decode_count} decoded in {self.decode_time * 1000:.1f} ms, "
+                f"{self.error_count} failed")
+
+    def delete(self):
+        """ Stop the audio thread and release every voice. """
+        self.commands.put(None)
+        self.thread.join()
+        for pool in self.pools.values():
+            pool.delete()
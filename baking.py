@@ -0,0 +1,119 @@
+"""
+Static layer baking
+
+Background, foreground and platform tiles never move, so drawing them one
+sprite at a time every frame is wasted work. A BakedLayer paints all the
+tiles of a layer into large square chunk images once, when the level
+loads, and draws only the chunks the viewport can see.
+
+Baking is plain Pillow work with no OpenGL, so it can run on the level
+loading thread. It works from placements, (texture, width, height, alpha,
+center x, center y) tuples, so a layer can be baked from a sprite list or
+from a tile_layer.TileLayer without ever making its sprites.
+"""
+import math
+
+import arcade
+import PIL.Image
+
+# Width and height of one chunk, in world pixels
+CHUNK_SIZE = 1024
+
+
+def sprite_placements(sprite_list):
+    """ The placement of every sprite in a list, for baking. """
+    for sprite in sprite_list:
+        yield (sprite.texture, sprite.width, sprite.height, sprite.alpha,
+               sprite.center_x, sprite.center_y)
+
+
+def _tile_image(texture, width, height, alpha, resized_images):
+    """ A texture's image at the size it is drawn, shared between identical tiles. """
+    width = round(width)
+    height = round(height)
+    key = (texture.name, width, height, alpha)
+    image = resized_images.get(key)
+    if image is None:
+        image = texture.image.convert("RGBA")
+        if image.size != (width, height):
+            image = image.resize((width, height), PIL.Image.LANCZOS)
+        if alpha != 255:
+            image.putalpha(image.getchannel("A").point(lambda value: value * alpha // 255))
+        resized_images[key] = image
+    return image
+
+
+class BakedLayer:
+    """
+    A static layer, pre-rendered into chunk textures. Has a draw() method,
+    so it can stand in for the layer's sprite list when drawing.
+    """
+
+    def __init__(self, name, placements, chunk_size=CHUNK_SIZE):
+        self.name = name
+        self.chunk_size = chunk_size
+
+        # (chunk column, chunk row) -> SpriteList holding that chunk's one sprite
+        self.chunks = {}
+
+        self.bake(placements)
+
+    def bake(self, placements):
+        """ Paint every tile into the chunks it overlaps. """
+        chunk_size = self.chunk_size
+        images = {}
+        resized_images = {}
+
+        for texture, width, height, alpha, center_x, center_y in placements:
+            tile_image = _tile_image(texture, width, height, alpha, resized_images)
+            left = round(center_x - tile_image.width / 2)
+            bottom = round(center_y - tile_image.height / 2)
+            right = left + tile_image.width
+            top = bottom + tile_image.height
+
+            for column in range(left // chunk_size, (right - 1) // chunk_size + 1):
+                for row in range(bottom // chunk_size, (top - 1) // chunk_size + 1):
+                    image = images.get((column, row))
+                    if image is None:
+                        image = PIL.Image.new("RGBA", (chunk_size, chunk_size))
+                        images[(column, row)] = image
+
+                    # Images have y going down from the top of the chunk
+                    x = left - column * chunk_size
+                    y = (row + 1) * chunk_size - top
+                    image.alpha_composite(tile_image,
+                                          dest=(max(x, 0), max(y, 0)),
+                                          source=(max(-x, 0), max(-y, 0)))
+
+        self.chunks = {}
+        for (column, row), image in images.items():
+            texture = arcade.Texture(f"baked-{self.name}-{id(self)}-{column}-{row}",
+                                     image,
+                                     hit_box_algorithm="None")
+            chunk_sprite = arcade.Sprite()
+            chunk_sprite.texture = texture
+            chunk_sprite.center_x = column * chunk_size + chunk_size / 2
+            chunk_sprite.center_y = row * chunk_size + chunk_size / 2
+
+            # One list per chunk, so each chunk's texture is uploaded once and
+            # never rebuilt as chunks scroll in and out of view
+            chunk_list = arcade.SpriteList(is_static=True)
+            chunk_list.append(chunk_sprite)
+            self.chunks[(column, row)] = chunk_list
+
+    def visible_chunks(self, left, right, bottom, top):
+        """ The chunk lists overlapping a world-space rectangle. """
+        chunk_size = self.chunk_size
+        visible = []
+        for column in range(math.floor(left / chunk_size), math.floor(right / chunk_size) + 1):
+            for row in range(math.floor(bottom / chunk_size), math.floor(top / chunk_size) + 1):
+                chunk_list = self.chunks.get((column, row))
+                if chunk_list is not None:
+                    visible.append(chunk_list)
+        return visible
+
+    def draw(self):
+        """ Draw the chunks the current viewport can see. """
+        left, right, bottom, top = arcade.get_viewport()
+        for chunk_list in self.visible_chunks(left, right, bottom, top):
+            chunk_list.draw()
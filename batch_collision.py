@@ -0,0 +1,82 @@
+"""
+Batched bounding-box collision
+
+check_for_collision_with_list() tests one sprite against one list, with a
+polygon test per candidate, in Python. With many actors that loop is the
+cost. Here every actor's bounding box and every sprite's bounding box go
+into NumPy arrays, and all the overlaps between the two are found in a
+few array operations, giving (actor, sprite) hit pairs.
+
+These are bounding box tests only. Where the exact shape matters, run
+arcade.check_for_collision() on just the pairs that come back.
+"""
+import numpy
+
+# Largest actors x sprites comparison done in one go. Bigger batches are split
+# by actor, so the temporary arrays stay a few megabytes.
+MAX_PAIRS_PER_BATCH = 1 << 20
+
+LEFT, RIGHT, BOTTOM, TOP = range(4)
+
+
+def sprite_boxes(sprites):
+    """ An (n, 4) array of left, right, bottom, top for a sequence of sprites. """
+    boxes = numpy.empty((len(sprites), 4), dtype=numpy.float64)
+    for index, sprite in enumerate(sprites):
+        boxes[index] = (sprite.left, sprite.right, sprite.bottom, sprite.top)
+    return boxes
+
+
+def collide_boxes(actor_boxes, layer_boxes, max_pairs=MAX_PAIRS_PER_BATCH):
+    """
+    Every overlapping pair between two (n, 4) box arrays, as an (k, 2) array
+    of (actor index, layer index), sorted by actor. Boxes that only touch
+    don't overlap.
+    """
+    actor_boxes = numpy.asarray(actor_boxes, dtype=numpy.float64).reshape(-1, 4)
+    layer_boxes = numpy.asarray(layer_boxes, dtype=numpy.float64).reshape(-1, 4)
+    if len(actor_boxes) == 0 or len(layer_boxes) == 0:
+        return numpy.empty((0, 2), dtype=numpy.intp)
+
+    batch_size = max(1, max_pairs // len(layer_boxes))
+    pairs = []
+    for start in range(0, len(actor_boxes), batch_size):
+        actors = actor_boxes[start:start + batch_size]
+
+        # Skip the layer boxes nowhere near this batch of actors
+        nearby = numpy.flatnonzero((layer_boxes[:, LEFT] < actors[:, RIGHT].max())
+                                   & (layer_boxes[:, RIGHT] > actors[:, LEFT].min())
+                                   & (layer_boxes[:, BOTTOM] < actors[:, TOP].max())
+                                   & (layer_boxes[:, TOP] > actors[:, BOTTOM].min()))
+        if len(nearby) == 0:
+            continue
+        candidates = layer_boxes[nearby]
+
+        overlap = ((actors[:, LEFT, None] < candidates[None, :, RIGHT])
+                   & (actors[:, RIGHT, None] > candidates[None, :, LEFT])
+                   & (actors[:, BOTTOM, None] < candidates[None, :, TOP])
+                   & (actors[:, TOP, None] > candidates[None, :, BOTTOM]))
+        actor_indexes, candidate_indexes = numpy.nonzero(overlap)
+        pairs.append(numpy.column_stack((actor_indexes + start, nearby[candidate_indexes])))
+
+    if not pairs:
+        return numpy.empty((0, 2), dtype=numpy.intp)
+    return numpy.concatenate(pairs)
+
+
+class BoxLayer:
+    """ The bounding boxes of a sprite list whose sprites don't move, ready to query. """
+
+    def __init__(self, sprite_list):
+        self.sprites = list(sprite_list)
+        self.boxes = sprite_boxes(self.sprites)
+
+    def collide(self, actor_boxes):
+        """ (actor index, layer index) pairs, see collide_boxes(). """
+        return collide_boxes(actor_boxes, self.boxes)
+
+    def collide_sprites(self, actors):
+        """ (actor, sprite) pairs for a sequence of actor sprites. """
+        actors = list(actors)
+        return [(actors[actor_index], self.sprites[sprite_index])
+                for actor_index, sprite_index in self.collide(sprite_boxes(actors))]
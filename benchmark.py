@@ -0,0 +1,223 @@
+"""
+Benchmarks for level loading, physics and collision
+
+For every map in tmx_map/ this times read_tmx(), each process_layer()
+call, a compiled level_cache load, decoding the .tmx and building every
+layer on level_cache's layer threads, a PhysicsEnginePlatformer step, a
+grid_collision physics step, and check_for_collision_with_list() and a
+batch_collision query for BATCH_ACTORS actors against the coin and don't
+touch layers.
+Runs without a window.
+
+    python benchmark.py                   # run, save benchmark_results.json
+    python benchmark.py --save-baseline   # run, and make this the new baseline
+    python benchmark.py --maps tmx_map/mock1.tmx
+
+Each run is compared against benchmark_baseline.json if there is one, and
+exits with status 1 if anything got more than REGRESSION_THRESHOLD slower.
+A map that fails is reported and skipped, the rest still run, and the
+run exits with status 1 too.
+"""
+import argparse
+import glob
+import json
+import platform
+import statistics
+import sys
+import time
+
+# Before arcade, so this runs on machines with no display
+import headless
+
+import arcade
+
+import batch_collision
+import grid_collision
+import level_cache
+import level_pipeline
+import simulation
+
+RESULTS_FILE = "benchmark_results.json"
+BASELINE_FILE = "benchmark_baseline.json"
+
+# A metric regresses when it takes this many times its baseline
+REGRESSION_THRESHOLD = 1.2
+
+LOAD_REPEAT = 5
+PHYSICS_STEPS = 600
+COLLISION_CHECKS = 2000
+BATCH_ACTORS = 256
+
+
+def time_call(function, repeat):
+    """ Median wall time of calling function, in seconds. """
+    times = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start_time)
+    return statistics.median(times)
+
+
+def make_player():
+    """ A player sprite at the start position, the same as the game makes. """
+    player_sprite = arcade.Sprite("images/player_1/female_stand.png", simulation.CHARACTER_SCALING)
+    player_sprite.center_x = simulation.PLAYER_START_X
+    player_sprite.center_y = simulation.PLAYER_START_Y
+    return player_sprite
+
+
+def benchmark_physics(player_sprite, physics_engine):
+    """ Average time of one physics step, with the player running right and jumping. """
+    player_sprite.change_x = simulation.PLAYER_MOVEMENT_SPEED
+
+    start_time = time.perf_counter()
+    for step in range(PHYSICS_STEPS):
+        if step % 30 == 0 and physics_engine.can_jump():
+            player_sprite.change_y = simulation.PLAYER_JUMP_SPEED
+        physics_engine.update()
+        if player_sprite.center_y < -100 or step % 300 == 0:
+            player_sprite.center_x = simulation.PLAYER_START_X
+            player_sprite.center_y = simulation.PLAYER_START_Y
+    return (time.perf_counter() - start_time) / PHYSICS_STEPS
+
+
+def benchmark_collision(player_sprite, sprite_list):
+    """ Average time of one collision check, with the player walked across the map. """
+    start_time = time.perf_counter()
+    for check in range(COLLISION_CHECKS):
+        player_sprite.center_x = (check * 7) % 2000
+        arcade.check_for_collision_with_list(player_sprite, sprite_list)
+    return (time.perf_counter() - start_time) / COLLISION_CHECKS
+
+
+def benchmark_batch_collision(player_sprite, sprite_list):
+    """ Time of one batched query, for BATCH_ACTORS player-sized boxes spread across the map. """
+    box_layer = batch_collision.BoxLayer(sprite_list)
+    width = player_sprite.right - player_sprite.left
+    height = player_sprite.top - player_sprite.bottom
+    actor_boxes = [(x, x + width, y, y + height)
+                   for x, y in ((actor * 37 % 2000, actor * 53 % 800) for actor in range(BATCH_ACTORS))]
+    return time_call(lambda: box_layer.collide(actor_boxes), LOAD_REPEAT)
+
+
+def benchmark_map(map_name):
+    """ Run every benchmark against one map. Returns metric name -> seconds. """
+    results = {}
+
+    results["read_tmx"] = time_call(lambda: arcade.tilemap.read_tmx(map_name), LOAD_REPEAT)
+    results["level_cache.load_level"] = time_call(lambda: level_cache.load_level(map_name),
+                                                  LOAD_REPEAT)
+    results["level_cache.read_source"] = time_call(lambda: level_cache.read_source(map_name),
+                                                   LOAD_REPEAT)
+    results["level_cache.LazyLevel Platforms"] = time_call(
+        lambda: level_cache.LazyLevel(map_name).get_layer("Platforms"), LOAD_REPEAT)
+
+    compiled_level = level_cache.load_level(map_name)
+    all_layers = dict.fromkeys(compiled_level.layers, True)
+    results["level_cache.process_layers"] = time_call(
+        lambda: level_cache.process_layers(compiled_level, all_layers, simulation.TILE_SCALING),
+        LOAD_REPEAT)
+
+    my_map = arcade.tilemap.read_tmx(map_name)
+    layer_names = list(level_cache.read_source(map_name).layers)
+    sprite_lists = {}
+    for layer_name in layer_names:
+        results[f"process_layer {layer_name}"] = time_call(
+            lambda: arcade.tilemap.process_layer(my_map, layer_name, simulation.TILE_SCALING,
+                                                 use_spatial_hash=True),
+            LOAD_REPEAT)
+        sprite_lists[layer_name] = arcade.tilemap.process_layer(my_map, layer_name,
+                                                                simulation.TILE_SCALING,
+                                                                use_spatial_hash=True)
+
+    player_sprite = make_player()
+    wall_list = sprite_lists.get(level_pipeline.PLATFORMS_LAYER_NAME, arcade.SpriteList())
+    results["physics step"] = benchmark_physics(
+        player_sprite,
+        arcade.PhysicsEnginePlatformer(player_sprite, wall_list, simulation.GRAVITY))
+
+    platform_grid = grid_collision.TileGrid.from_layer(compiled_level,
+                                                       level_pipeline.PLATFORMS_LAYER_NAME,
+                                                       simulation.TILE_SCALING)
+    results["grid physics step"] = benchmark_physics(
+        player_sprite,
+        grid_collision.GridPhysicsEngine(player_sprite, platform_grid, simulation.GRAVITY))
+
+    for layer_name in (level_pipeline.COINS_LAYER_NAME, level_pipeline.DONT_TOUCH_LAYER_NAME):
+        if layer_name in sprite_lists:
+            results[f"collision {layer_name}"] = benchmark_collision(player_sprite,
+                                                                     sprite_lists[layer_name])
+            results[f"batch collision {layer_name}"] = benchmark_batch_collision(
+                player_sprite, sprite_lists[layer_name])
+
+    return results
+
+
+def compare(results, baseline):
+    """ Return (map, metric, baseline, now) for everything that got too much slower. """
+    regressions = []
+    for map_name, metrics in results["maps"].items():
+        baseline_metrics = baseline["maps"].get(map_name, {})
+        for metric, seconds in metrics.items():
+            baseline_seconds = baseline_metrics.get(metric)
+            if baseline_seconds and seconds > baseline_seconds * REGRESSION_THRESHOLD:
+                regressions.append((map_name, metric, baseline_seconds, seconds))
+    return regressions
+
+
+def main():
+    """ Run the benchmarks and compare them with the baseline """
+    parser = argparse.ArgumentParser(description="Benchmark level loading, physics and collision")
+    parser.add_argument("--maps", nargs="*", default=sorted(glob.glob("tmx_map/*.tmx")))
+    parser.add_argument("--output", default=RESULTS_FILE)
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="write the results to the baseline file as well")
+    args = parser.parse_args()
+
+    results = {"python": platform.python_version(),
+               "arcade": arcade.__version__,
+               "maps": {},
+               "errors": {}}
+    for map_name in args.maps:
+        try:
+            results["maps"][map_name] = benchmark_map(map_name)
+        except Exception as error:
+            print(f"ERROR {map_name}: {error!r}")
+            results["errors"][map_name] = repr(error)
+            continue
+        for metric, seconds in results["maps"][map_name].items():
+            print(f"{map_name:<32}{metric:<36}{seconds * 1000:>10.3f} ms")
+
+    with open(args.output, "w") as results_file:
+        json.dump(results, results_file, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+        if results["errors"]:
+            sys.exit(1)
+        return
+
+    try:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    except FileNotFoundError:
+        print(f"No baseline at {args.baseline}, run with --save-baseline to make one")
+        if results["errors"]:
+            sys.exit(1)
+        return
+
+    regressions = compare(results, baseline)
+    for map_name, metric, baseline_seconds, seconds in regressions:
+        print(f"REGRESSION {map_name} {metric}: "
+              f"{baseline_seconds * 1000:.3f} ms -> {seconds * 1000:.3f} ms")
+    if regressions or results["errors"]:
+        sys.exit(1)
+    print("No regressions")
+
+
+if __name__ == "__main__":
+    main()
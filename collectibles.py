@@ -0,0 +1,148 @@
+"""
+Collectible layers
+
+Taking a coin out of its sprite list with remove_from_sprite_lists() pulls
+it out of the spatial hash and makes arcade rebuild the list's buffers,
+and the cost of both grows with the number of coins in the list. A
+CollectibleLayer leaves collected coins where they are: it sets their bit
+in a bitset and hides them by setting their alpha to 0, which only
+touches that one sprite's color in the buffer.
+
+Collected coins still take up room in the list, so once enough of them
+have piled up, the layer compacts: a fresh list of the coins that are
+left is built on level_cache's layer threads, from the sprite_pool, and
+a later step hands it to whatever owns the old list, which swaps it in
+and gives the old one back to the pool. The step that crosses the
+threshold only copies the list and the bitset.
+"""
+import arcade
+
+import level_cache
+import sprite_pool
+
+# Compact once this fraction of the list has been collected...
+COMPACT_FRACTION = 0.5
+
+# ...and there are at least this many collected coins to get rid of
+COMPACT_MINIMUM = 32
+
+
+class CollectibleLayer:
+    """ A sprite list of pickups that are hidden, not removed, when collected. """
+
+    def __init__(self, sprite_list, name=None, replace_list=None,
+                 compact_fraction=COMPACT_FRACTION, compact_minimum=COMPACT_MINIMUM):
+        self.compact_fraction = compact_fraction
+        self.compact_minimum = compact_minimum
+
+        self.sprite_list = sprite_list
+        # Layer name the sprite_pool keeps compacted lists under
+        self.name = name
+
+        # Called with the compacted list, by the list's owner, to swap it in
+        # for the old one and be done with the old one. Without it, the old
+        # list goes straight back to the sprite_pool.
+        self.replace_list = replace_list
+
+        # id(sprite) -> bit number in collected, for every sprite the layer started with
+        self.indexes = {id(sprite): index for index, sprite in enumerate(sprite_list)}
+        self.collected = bytearray((len(self.indexes) + 7) // 8)
+
+        self.remaining = len(self.indexes)
+
+        # Collected sprites still in sprite_list
+        self.hidden_count = 0
+        self.compact_count = 0
+
+        # Future of the compacted list being built, and how many pickups were
+        # left when it started
+        self.compaction = None
+        self.compaction_remaining = 0
+
+    def is_collected(self, sprite, collected=None):
+        """ Has this pickup been collected? Or had it been, going by an older copy of the bits. """
+        if collected is None:
+            collected = self.collected
+        index = self.indexes[id(sprite)]
+        return bool(collected[index >> 3] & (1 << (index & 7)))
+
+    def collect(self, sprite):
+        """ Mark a pickup collected and hide it. Returns False if it already was. """
+        index = self.indexes[id(sprite)]
+        bit = 1 << (index & 7)
+        if self.collected[index >> 3] & bit:
+            return False
+        self.collected[index >> 3] |= bit
+        sprite.alpha = 0
+        self.remaining -= 1
+        self.hidden_count += 1
+        return True
+
+    def collisions(self, sprite):
+        """ The pickups touching a sprite that haven't been collected yet. """
+        hit_list = arcade.check_for_collision_with_list(sprite, self.sprite_list)
+        return [pickup for pickup in hit_list if not self.is_collected(pickup)]
+
+    def needs_compacting(self):
+        """ Have enough collected pickups piled up in the list to be worth a rebuild? """
+        return (self.hidden_count >= self.compact_minimum
+                and self.hidden_count >= len(self.sprite_list) * self.compact_fraction)
+
+    def start_compaction(self):
+        """ Start building a list of the pickups that are left, in the background. """
+        use_spatial_hash = True if self.sprite_list.spatial_hash is not None else None
+        self.compaction = level_cache.layer_executor().submit(
+            self.build_compacted, list(self.sprite_list), bytes(self.collected), use_spatial_hash)
+        self.compaction_remaining = self.remaining
+
+    def build_compacted(self, sprites, collected, use_spatial_hash):
+        """ A sprite list of the sprites not set in collected. Runs on a layer thread. """
+        new_list = sprite_pool.pool.sprite_list(self.name, use_spatial_hash)
+        new_list.extend(sprite for sprite in sprites if not self.is_collected(sprite, collected))
+        return new_list
+
+    def finish_compaction(self):
+        """ Swap in the list start_compaction() built. """
+        new_list = self.compaction.result()
+        self.compaction = None
+
+        old_list = self.sprite_list
+        self.sprite_list = new_list
+        if self.replace_list is not None:
+            self.replace_list(new_list)
+        else:
+            sprite_pool.pool.recycle_list(old_list, self.name)
+
+        # Pickups collected while it was built are still in it, hidden
+        self.hidden_count = self.compaction_remaining - self.remaining
+        self.compact_count += 1
+
+    def compact(self):
+        """ Swap in a new sprite list holding only the pickups that are left, waiting for it. """
+        if self.compaction is None:
+            self.start_compaction()
+        self.compaction.result()
+        self.finish_compaction()
+
+    def compact_if_needed(self):
+        """
+        Start compacting if it's time to, and swap in a compaction once it's
+        built. Cheap to call every step.
+        """
+        if self.compaction is not None:
+            if self.compaction.done():
+                self.finish_compaction()
+        elif self.needs_compacting():
+            self.start_compaction()
+
+    def release(self):
+        """ Done with this layer. A compaction still being built goes back to the pool. """
+        if self.compaction is not None:
+            if not self.compaction.cancel():
+                self.compaction.add_done_callback(self._recycle_compaction)
+            self.compaction = None
+
+    def _recycle_compaction(self, future):
+        """ Give an unwanted compacted list back to the sprite_pool. """
+        if future.exception() is None:
+            sprite_pool.pool.recycle_list(future.result(), self.name)
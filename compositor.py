@@ -0,0 +1,81 @@
+"""
+Render layer compositor
+
+The draw order of the game's layers is declared once, here, instead of
+being a list of draw() calls in on_draw(). Every frame each layer is
+drawn exactly once, in order, and drawing the same sprite list under two
+layer names is an error rather than a silently doubled draw call.
+"""
+
+
+class RenderLayer:
+    """ A named layer. `source` is called every frame to get the thing to draw. """
+
+    def __init__(self, name, source):
+        self.name = name
+        self.source = source
+
+
+class RenderCompositor:
+    """ Draws an ordered set of layers, once each. """
+
+    def __init__(self, frame_profiler=None):
+        self.layers = []
+        self.frame_profiler = frame_profiler
+
+        # layer name -> draws in the last frame, and since the start
+        self.frame_draws = {}
+        self.total_draws = {}
+
+    def layer_names(self):
+        """ Layer names, in the order they are drawn. """
+        return [layer.name for layer in self.layers]
+
+    def add_layer(self, name, source, before=None):
+        """
+        Add a layer on top of the others, or just under the layer named
+        `before`. `source` is a function returning something with a draw()
+        method, or None to skip the layer this frame.
+        """
+        if name in self.layer_names():
+            raise ValueError(f"There is already a render layer named '{name}'.")
+
+        layer = RenderLayer(name, source)
+        if before is None:
+            self.layers.append(layer)
+        else:
+            self.layers.insert(self.layer_names().index(before), layer)
+
+    def remove_layer(self, name):
+        """ Stop drawing a layer. """
+        self.layers.pop(self.layer_names().index(name))
+
+    def draw(self):
+        """ Draw every layer once, bottom to top. """
+        drawn = {}
+        self.frame_draws = {}
+
+        for layer in self.layers:
+            drawable = layer.source()
+            if drawable is None:
+                continue
+
+            if id(drawable) in drawn:
+                raise ValueError(f"Render layers '{drawn[id(drawable)]}' and '{layer.name}' "
+                                 f"draw the same object.")
+            drawn[id(drawable)] = layer.name
+
+            if self.frame_profiler is None:
+                drawable.draw()
+            else:
+                start_time = self.frame_profiler.start()
+                drawable.draw()
+                self.frame_profiler.stop(f"draw {layer.name}", start_time)
+
+            self.frame_draws[layer.name] = self.frame_draws.get(layer.name, 0) + 1
+            self.total_draws[layer.name] = self.total_draws.get(layer.name, 0) + 1
+
+    def report(self):
+        """ One line listing how many times each layer was drawn last frame. """
+        counts = ", ".join(f"{name} {count}" for name, count in self.frame_draws.items())
+        return f"layers drawn: {counts}"
@@ -0,0 +1,111 @@
+"""
+Viewport culling
+
+A CulledLayer keeps a grid index of where a layer's sprites are, and
+each frame draws only the sprites near the viewport. The selection
+covers the viewport plus a margin, so it stays valid, and is reused,
+until the viewport has moved further than REUSE_DISTANCE.
+
+The index is built once, so this is for layers whose sprites don't move.
+Sprites removed from the layer, or hidden with an alpha of 0 (collected
+coins), are left out of the next selection.
+"""
+import math
+
+import arcade
+
+import sprite_pool
+
+# Size of one cell of the grid index, in world pixels
+INDEX_CELL_SIZE = 256
+
+# Keep using the same selection until the viewport moves this far. One tile.
+REUSE_DISTANCE = 64
+
+# Extra world pixels selected around the viewport. Must be at least
+# REUSE_DISTANCE, so a reused selection still covers the whole screen.
+CULL_MARGIN = 128
+
+
+class CulledLayer:
+    """ Draws the part of a static sprite list that is near the viewport. """
+
+    def __init__(self, source, cell_size=INDEX_CELL_SIZE, margin=CULL_MARGIN,
+                 reuse_distance=REUSE_DISTANCE):
+        self.source = source
+        self.cell_size = cell_size
+        self.margin = margin
+        self.reuse_distance = reuse_distance
+
+        # (cell column, cell row) -> indexes into the source list, in draw order
+        self.cells = {}
+
+        # Kept for the life of the layer and emptied in place for each
+        # selection, so its sprite sheet isn't rebuilt every time
+        self.visible_list = arcade.SpriteList()
+        self.selection_viewport = None
+        self.selection_count = 0
+
+        self.rebuild_index()
+
+    def rebuild_index(self):
+        """ Re-index every sprite in the source list. Call this if they move. """
+        cell_size = self.cell_size
+        self.sprites = list(self.source)
+        self.cells = {}
+        for index, sprite in enumerate(self.sprites):
+            half_width = sprite.width / 2
+            half_height = sprite.height / 2
+            first_column = math.floor((sprite.center_x - half_width) / cell_size)
+            last_column = math.floor((sprite.center_x + half_width) / cell_size)
+            first_row = math.floor((sprite.center_y - half_height) / cell_size)
+            last_row = math.floor((sprite.center_y + half_height) / cell_size)
+            for column in range(first_column, last_column + 1):
+                for row in range(first_row, last_row + 1):
+                    self.cells.setdefault((column, row), []).append(index)
+        self.selection_viewport = None
+
+    def select(self, left, right, bottom, top):
+        """ Return the sprites within a world-space rectangle, in draw order. """
+        cell_size = self.cell_size
+        indexes = set()
+        for column in range(math.floor(left / cell_size), math.floor(right / cell_size) + 1):
+            for row in range(math.floor(bottom / cell_size), math.floor(top / cell_size) + 1):
+                indexes.update(self.cells.get((column, row), ()))
+
+        selected = []
+        for index in sorted(indexes):
+            sprite = self.sprites[index]
+            # Skip anything removed or hidden since it was indexed
+            if sprite.alpha > 0 and self.source in sprite.sprite_lists:
+                selected.append(sprite)
+        return selected
+
+    def needs_new_selection(self, left, bottom):
+        """ Has the viewport moved too far for the last selection to cover it? """
+        if self.selection_viewport is None:
+            return True
+        last_left, last_bottom = self.selection_viewport
+        return (abs(left - last_left) > self.reuse_distance
+                or abs(bottom - last_bottom) > self.reuse_distance)
+
+    def release(self):
+        """
+        Unregister the selection from its sprites, or every sprite would keep
+        a reference to every selection it was ever part of.
+        """
+        sprite_pool.clear_list(self.visible_list)
+        self.selection_viewport = None
+
+    def draw(self):
+        """ Draw the sprites near the current viewport. """
+        left, right, bottom, top = arcade.get_viewport()
+        if self.needs_new_selection(left, bottom):
+            self.release()
+            self.visible_list.extend(self.select(left - self.margin,
+                                                 right + self.margin,
+                                                 bottom - self.margin,
+                                                 top + self.margin))
+            self.selection_viewport = (left, bottom)
+            self.selection_count += 1
+        self.visible_list.draw()
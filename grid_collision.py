@@ -0,0 +1,157 @@
+"""
+Tile-grid collision
+
+Platforms and hazards sit on the map's tile grid, so whether a rectangle
+touches any of them comes down to looking up the few cells it covers.
+A TileGrid holds one byte per cell, built straight from a compiled
+layer's gids, and GridPhysicsEngine is a stand-in for arcade's
+PhysicsEnginePlatformer that resolves the player's bounding box against
+it. Neither looks at more than a handful of cells, however big the level.
+
+Every tile counts as a full, square cell. Half tiles and slopes, which
+the sprite backend collides with by their hit boxes, are solid blocks
+here, so the two backends don't move the player identically.
+"""
+import math
+
+
+class TileGrid:
+    """ Which cells of a tile layer are filled. Row 0 is the bottom row. """
+
+    def __init__(self, width, height, cell_size, cells):
+        self.width = width
+        self.height = height
+        self.cell_size = cell_size
+
+        # width * height bytes, 1 for a filled cell, bottom row first
+        self.cells = cells
+
+    @classmethod
+    def from_layer(cls, level, layer_name, scaling=1):
+        """ Build a grid from a layer of a level_cache.CompiledLevel. """
+        cell_size = level.tile_width * scaling
+        layer = level.get_layer(layer_name)
+        if layer is None:
+            return cls(level.map_width, level.map_height, cell_size,
+                       bytearray(level.map_width * level.map_height))
+
+        width = layer.width
+        height = layer.height
+        gids = layer.gids
+        cells = bytearray(width * height)
+        for row in range(height):
+            # gids are stored top row first
+            source = gids[(height - 1 - row) * width:(height - row) * width]
+            cells[row * width:(row + 1) * width] = bytes(1 if gid else 0 for gid in source)
+        return cls(width, height, cell_size, cells)
+
+    def is_filled(self, column, row):
+        """ Is there a tile in this cell? Everything outside the grid is empty. """
+        if 0 <= column < self.width and 0 <= row < self.height:
+            return self.cells[row * self.width + column] == 1
+        return False
+
+    def cell_range(self, left, right, bottom, top):
+        """ The (first column, last column, first row, last row) a rectangle overlaps. """
+        cell_size = self.cell_size
+        # Edges that only touch a cell don't overlap it
+        return (max(math.floor(left / cell_size), 0),
+                min(math.ceil(right / cell_size) - 1, self.width - 1),
+                max(math.floor(bottom / cell_size), 0),
+                min(math.ceil(top / cell_size) - 1, self.height - 1))
+
+    def filled_cells(self, left, right, bottom, top):
+        """ (column, row) of every filled cell a rectangle overlaps. """
+        first_column, last_column, first_row, last_row = self.cell_range(left, right, bottom, top)
+        cells = self.cells
+        width = self.width
+        return [(column, row)
+                for row in range(first_row, last_row + 1)
+                for column in range(first_column, last_column + 1)
+                if cells[row * width + column]]
+
+    def overlaps(self, left, right, bottom, top):
+        """ Does a rectangle overlap any filled cell? """
+        first_column, last_column, first_row, last_row = self.cell_range(left, right, bottom, top)
+        cells = self.cells
+        width = self.width
+        for row in range(first_row, last_row + 1):
+            row_start = row * width
+            for column in range(first_column, last_column + 1):
+                if cells[row_start + column]:
+                    return True
+        return False
+
+    def overlaps_sprite(self, sprite):
+        """ Does a sprite's bounding box overlap any filled cell? """
+        return self.overlaps(sprite.left, sprite.right, sprite.bottom, sprite.top)
+
+
+class GridPhysicsEngine:
+    """
+    A platformer physics engine that collides one sprite with a TileGrid.
+    Has the can_jump() and update() that the game uses from
+    arcade.PhysicsEnginePlatformer.
+    """
+
+    def __init__(self, player_sprite, grid, gravity_constant=0.5):
+        self.player_sprite = player_sprite
+        self.grid = grid
+        self.gravity_constant = gravity_constant
+
+    def _box(self):
+        """ The player's bounding box, as offsets from its center. """
+        sprite = self.player_sprite
+        return (sprite.center_x - sprite.left, sprite.right - sprite.center_x,
+                sprite.center_y - sprite.bottom, sprite.top - sprite.center_y)
+
+    def can_jump(self, y_distance=5):
+        """ Is there ground within y_distance below the sprite? """
+        sprite = self.player_sprite
+        bottom = sprite.bottom
+        return self.grid.overlaps(sprite.left, sprite.right, bottom - y_distance, bottom)
+
+    def update(self):
+        """ Apply gravity, then move the sprite, stopping it at filled cells. """
+        sprite = self.player_sprite
+        grid = self.grid
+        cell_size = grid.cell_size
+        left_offset, right_offset, bottom_offset, top_offset = self._box()
+
+        sprite.change_y -= self.gravity_constant
+
+        # --- Move in the y direction, and land on or bump into the cells hit
+        center_x = sprite.center_x
+        center_y = sprite.center_y + sprite.change_y
+        hit_cells = grid.filled_cells(center_x - left_offset, center_x + right_offset,
+                                      center_y - bottom_offset, center_y + top_offset)
+        if hit_cells:
+            if sprite.change_y > 0:
+                lowest_row = min(row for _, row in hit_cells)
+                center_y = lowest_row * cell_size - top_offset
+            elif sprite.change_y < 0:
+                highest_row = max(row for _, row in hit_cells)
+                center_y = (highest_row + 1) * cell_size + bottom_offset
+            sprite.change_y = 0
+        center_y = round(center_y, 2)
+
+        # --- Move in the x direction, stepping up a little if that gets past the cell hit
+        if sprite.change_x:
+            new_x = center_x + sprite.change_x
+            if grid.overlaps(new_x - left_offset, new_x + right_offset,
+                             center_y - bottom_offset, center_y + top_offset):
+                step_up = abs(sprite.change_x)
+                if not grid.overlaps(new_x - left_offset, new_x + right_offset,
+                                     center_y + step_up - bottom_offset,
+                                     center_y + step_up + top_offset):
+                    center_y += step_up
+                elif sprite.change_x > 0:
+                    # Right edge against the left edge of the blocking column
+                    new_x = math.ceil((center_x + right_offset) / cell_size) * cell_size - right_offset
+                else:
+                    new_x = math.floor((center_x - left_offset) / cell_size) * cell_size + left_offset
+            center_x = new_x
+
+        sprite.center_x = center_x
+        sprite.center_y = center_y
+
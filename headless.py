@@ -0,0 +1,17 @@
+"""
+Running without a display
+
+arcade makes pyglet create a hidden shadow window as soon as it's
+imported, which fails on a machine with no display. Import this module
+before arcade in anything that can run headless, like the simulation and
+the offline tools.
+"""
+import os
+import sys
+
+import pyglet
+
+# With no display to connect to, pyglet can't create its hidden shadow
+# window. Nothing headless draws, so just don't ask for one.
+if sys.platform.startswith("linux") and not os.environ.get("DISPLAY"):
+    pyglet.options["shadow_window"] = False
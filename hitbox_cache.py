@@ -0,0 +1,187 @@
+"""
+Persistent hit box cache
+
+arcade works out a sprite's hit box from its image's alpha channel, one
+pixel at a time in Python, the first time the sprite is collided with.
+For a level's worth of tiles that is a large part of a cold load. Here
+each hit box is computed once and saved, keyed by a hash of the image's
+contents, its flips and the hit box algorithm, so later runs, and images
+that are copies of each other, only look it up. Changing an image changes
+its hash, so a stale hit box is never used. The file also records the
+arcade version that computed it, and is thrown away when that changes,
+since the hit box algorithms are arcade's.
+
+Tiles with a hit box drawn in their tileset use that instead, see
+level_cache. Fill the cache ahead of time for every map with:
+
+    python hitbox_cache.py
+"""
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+
+# Before arcade, so this runs on machines with no display
+import headless
+
+import arcade
+
+import level_cache
+
+HIT_BOX_FILE = os.path.join(level_cache.CACHE_DIRECTORY, "hitboxes.json")
+HIT_BOX_VERSION = 2
+
+# Passed to arcade.calculate_hit_box_points_detailed(), same as arcade's default
+HIT_BOX_DETAIL = 4.5
+
+
+def calculate_hit_box(image, hit_box_algorithm="Simple"):
+    """ Hit box points for an image, the way arcade.Texture works them out. """
+    if hit_box_algorithm == "Simple":
+        return arcade.calculate_hit_box_points_simple(image)
+    if hit_box_algorithm == "Detailed":
+        return arcade.calculate_hit_box_points_detailed(image, HIT_BOX_DETAIL)
+    half_width = image.width / 2
+    half_height = image.height / 2
+    return ((-half_width, -half_height), (half_width, -half_height),
+            (half_width, half_height), (-half_width, half_height))
+
+
+class HitBoxCache:
+    """ Hit boxes by image contents, read from and saved to a JSON file. """
+
+    def __init__(self, file_name=HIT_BOX_FILE):
+        self.file_name = file_name
+
+        # key -> hit box points, read from the file the first time they're needed
+        self.hit_boxes = None
+        # resolved image path -> content hash, for this run
+        self.image_hashes = {}
+        self.dirty = False
+        self.lock = threading.Lock()
+        # Held while the file is written, so two saves never share the temporary file
+        self.save_lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.compute_time = 0.0
+
+    def _load(self):
+        """ Read the file, if there is a current one. Call with the lock held. """
+        self.hit_boxes = {}
+        try:
+            with open(self.file_name) as file:
+                saved = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return
+        if (saved.get("version") == HIT_BOX_VERSION
+                and saved.get("arcade") == arcade.__version__):
+            self.hit_boxes = {key: tuple(tuple(point) for point in points)
+                              for key, points in saved["hit_boxes"].items()}
+
+    def image_hash(self, image_file):
+        """ A hash of an image file's contents, read once per run. """
+        path = os.path.realpath(image_file)
+        image_hash = self.image_hashes.get(path)
+        if image_hash is None:
+            with open(path, "rb") as file:
+                image_hash = hashlib.sha256(file.read()).hexdigest()
+            self.image_hashes[path] = image_hash
+        return image_hash
+
+    def points(self, image_file, image, flipped_horizontally=False, flipped_vertically=False,
+               flipped_diagonally=False, hit_box_algorithm="Simple"):
+        """
+        The hit box for an image file, given its image already loaded and
+        flipped. Computed from the image only if it's not cached.
+        """
+        key = (f"{self.image_hash(image_file)}-{hit_box_algorithm}-"
+               f"{flipped_horizontally:d}{flipped_vertically:d}{flipped_diagonally:d}")
+        with self.lock:
+            if self.hit_boxes is None:
+                self._load()
+            points = self.hit_boxes.get(key)
+            if points is not None:
+                self.hits += 1
+                return points
+            self.misses += 1
+
+        start_time = time.perf_counter()
+        points = tuple(tuple(point) for point in calculate_hit_box(image, hit_box_algorithm))
+        with self.lock:
+            self.compute_time += time.perf_counter() - start_time
+            self.hit_boxes[key] = points
+            self.dirty = True
+        return points
+
+    def save(self):
+        """
+        Write the file, if anything new was computed since it was read. The
+        main thread and the level loading thread can both call this.
+        """
+        with self.save_lock:
+            with self.lock:
+                if not self.dirty:
+                    return
+                saved = {"version": HIT_BOX_VERSION,
+                         "arcade": arcade.__version__,
+                         "hit_boxes": dict(self.hit_boxes)}
+                self.dirty = False
+
+            os.makedirs(os.path.dirname(self.file_name) or ".", exist_ok=True)
+            # Write to a temporary name first so a half written file is never picked up
+            temporary_name = self.file_name + ".tmp"
+            with open(temporary_name, "w") as file:
+                json.dump(saved, file)
+            os.replace(temporary_name, self.file_name)
+
+    def report(self):
+        """ One line of cache statistics. """
+        return (f"hit boxes: {self.hits} cached, {self.misses} computed "
+                f"in {self.compute_time * 1000:.1f} ms")
+
+
+# The cache every sprite's hit box comes from
+hit_boxes = HitBoxCache()
+
+
+def main():
+    """ Compute the hit box of every tile every map uses, and the other sprite images. """
+    import texture_atlas
+    import texture_cache
+
+    def compute(image_file, *flips):
+        texture = texture_cache.cache.texture(image_file, *flips)
+        hit_boxes.points(image_file, texture.image, *flips)
+
+    for map_name in sorted(glob.glob("tmx_map/*.tmx")):
+        level = level_cache.load_level(map_name)
+        # Each image, with every set of flips the map places it with
+        tiles = set()
+        for layer in level.layers.values():
+            for gid in set(layer.gids):
+                tile_gid = gid & level_cache.GID_MASK
+                if tile_gid in level.tiles and tile_gid not in level.hit_boxes:
+                    tiles.add((level.tiles[tile_gid][0],
+                               bool(gid & level_cache.FLIPPED_HORIZONTALLY_FLAG),
+                               bool(gid & level_cache.FLIPPED_VERTICALLY_FLAG),
+                               bool(gid & level_cache.FLIPPED_DIAGONALLY_FLAG)))
+
+        for image_file, *flips in sorted(tiles):
+            if os.path.exists(image_file):
+                compute(image_file, *flips)
+            else:
+                print(f"Warning, {map_name} uses missing image '{image_file}'.")
+
+    for pattern in texture_atlas.SPRITE_IMAGES:
+        for image_file in sorted(glob.glob(pattern)):
+            compute(image_file)
+
+    hit_boxes.save()
+    print(hit_boxes.report())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Screen-space HUD
+
+arcade.draw_text() builds a cache key, looks its label up and draws it as
+a sprite list of its own, every call, every frame. The HUD instead keeps
+each line of text as a sprite in one sprite list. A line's text is only
+rendered again when it changes, and the list is drawn with a fixed
+screen-space viewport, so scrolling never moves or re-uploads it.
+"""
+import collections
+
+import arcade
+
+# Rendered text textures kept for reuse, least recently used dropped first
+TEXT_CACHE_SIZE = 256
+
+DEFAULT_FONT = ("calibri", "arial")
+
+
+class TextCache:
+    """ Rendered text textures, keyed by the text and its style. """
+
+    def __init__(self, size=TEXT_CACHE_SIZE):
+        self.size = size
+        self.textures = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, text, color, font_size, font_name=DEFAULT_FONT):
+        """ The texture for a piece of text, rendering it if it isn't cached. """
+        key = (text, tuple(color), font_size, font_name)
+        texture = self.textures.get(key)
+        if texture is not None:
+            self.textures.move_to_end(key)
+            self.hits += 1
+            return texture
+
+        self.misses += 1
+        image = arcade.get_text_image(text, color, font_size, font_name=font_name)
+        texture = arcade.Texture(f"hud-text-{key}", image, hit_box_algorithm="None")
+        self.textures[key] = texture
+        if len(self.textures) > self.size:
+            self.textures.popitem(last=False)
+        return texture
+
+
+class HudText:
+    """ One line of HUD text, anchored by its bottom left corner in screen pixels. """
+
+    def __init__(self, x, y, color, font_size, font_name=DEFAULT_FONT):
+        self.x = x
+        self.y = y
+        self.color = color
+        self.font_size = font_size
+        self.font_name = font_name
+        self.text = None
+        self.sprite = arcade.Sprite()
+
+
+class Hud:
+    """ Named lines of text drawn over the game, in screen space. """
+
+    def __init__(self, screen_width, screen_height, text_cache=None):
+        self.screen_width = screen_width
+        self.screen_height = screen_height
+        self.text_cache = text_cache if text_cache is not None else TextCache()
+
+        # name -> HudText
+        self.items = {}
+        self.sprite_list = arcade.SpriteList()
+
+        # How many times a line's text actually changed
+        self.render_count = 0
+
+    def add_text(self, name, x, y, color, font_size, font_name=DEFAULT_FONT):
+        """ Add an empty line of text. Give it something to say with set_text(). """
+        if name in self.items:
+            raise ValueError(f"There is already a HUD item named '{name}'.")
+        self.items[name] = HudText(x, y, color, font_size, font_name)
+
+    def set_text(self, name, text):
+        """ Change what a line says. Costs nothing if the text is the same. """
+        item = self.items[name]
+        if text == item.text:
+            return
+        item.text = text
+        self.render_count += 1
+
+        sprite = item.sprite
+        if not text:
+            if self.sprite_list in sprite.sprite_lists:
+                self.sprite_list.remove(sprite)
+            return
+
+        sprite.texture = self.text_cache.get(text, item.color, item.font_size, item.font_name)
+        sprite.center_x = item.x + sprite.width / 2
+        sprite.center_y = item.y + sprite.height / 2
+        if self.sprite_list in sprite.sprite_lists:
+            # Setting the texture doesn't pass the new size on to the list
+            self.sprite_list.update_size(sprite)
+        else:
+            self.sprite_list.append(sprite)
+
+    def draw(self):
+        """ Draw every line, then put the world viewport back. """
+        if len(self.sprite_list) == 0:
+            return
+        left, right, bottom, top = arcade.get_viewport()
+        arcade.set_viewport(0, self.screen_width, 0, self.screen_height)
+        self.sprite_list.draw()
+        arcade.set_viewport(left, right, bottom, top)
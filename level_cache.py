@@ -0,0 +1,594 @@
+"""
+Compiled binary level cache for the tiled maps
+
+Parsing a .tmx file means walking the XML, and base64 decoding and
+inflating every layer. This module does that work once, writes the result
+to a compact binary file, and memory-maps that file on later loads.
+
+The .tmx files themselves are read by LazyLevel in one streaming pass,
+without building an XML tree: it reads the tilesets, and only notes where
+each layer is in the file. A layer is decoded when it is first asked for,
+so a tool that needs just the platforms never decodes anything else.
+
+Decoding a map's layers, and building their sprites, happens on a small
+thread pool, a layer per thread. zlib and PIL let go of the GIL while
+they work, so the layers overlap.
+
+Compile every map ahead of time with:
+
+    python level_cache.py
+"""
+import base64
+import concurrent.futures
+import glob
+import gzip
+import hashlib
+import math
+import mmap
+import os
+import struct
+import sys
+import threading
+import xml.etree.ElementTree as ElementTree
+import xml.parsers.expat as expat
+import zlib
+
+CACHE_DIRECTORY = "level_cache"
+CACHE_EXTENSION = ".lvl"
+CACHE_MAGIC = b"FHLC"
+CACHE_VERSION = 3
+
+FLIPPED_HORIZONTALLY_FLAG = 0x80000000
+FLIPPED_VERTICALLY_FLAG = 0x40000000
+FLIPPED_DIAGONALLY_FLAG = 0x20000000
+GID_MASK = 0x1FFFFFFF
+
+# Threads that decode and build a level's layers side by side, one per layer
+LAYER_WORKERS = 5
+
+# Bytes of a .tmx file handed to the XML parser at a time
+PARSE_CHUNK_SIZE = 64 * 1024
+
+# magic, version, map width/height, tile width/height,
+# has background color, r, g, b, tile count, layer count, source hash
+_HEADER = struct.Struct("<4sHxxIIIIBBBBHH32s")
+# gid, image width, image height, path length, hit box point count
+_TILE = struct.Struct("<IIIHH")
+# name length, layer width, layer height, opacity
+_LAYER = struct.Struct("<HIIf")
+
+
+class CompiledLevel:
+    """ A tiled map, reduced to what the game needs to build sprite lists. """
+
+    def __init__(self, source, source_hash, map_width, map_height, tile_width, tile_height,
+                 background_color, tiles, layers, hit_boxes=None):
+        self.source = source
+        self.source_hash = source_hash
+        self.map_width = map_width
+        self.map_height = map_height
+        self.tile_width = tile_width
+        self.tile_height = tile_height
+        self.background_color = background_color
+
+        # gid -> (image file, image width, image height)
+        self.tiles = tiles
+
+        # layer name -> CompiledLayer
+        self.layers = layers
+
+        # gid -> hit box points drawn in the tileset, relative to the image center
+        self.hit_boxes = hit_boxes if hit_boxes is not None else {}
+
+    def get_layer(self, layer_name):
+        """ Return the named layer, or None if the map doesn't have one. """
+        return self.layers.get(layer_name)
+
+
+class CompiledLayer:
+    """ One tile layer. `gids` holds width * height ints, top row first. """
+
+    def __init__(self, name, width, height, opacity, gids):
+        self.name = name
+        self.width = width
+        self.height = height
+        self.opacity = opacity
+        self.gids = gids
+
+
+_layer_executor = None
+_layer_executor_lock = threading.Lock()
+
+
+def layer_executor():
+    """ The thread pool shared by all layer work, started the first time it's needed. """
+    global _layer_executor
+    with _layer_executor_lock:
+        if _layer_executor is None:
+            _layer_executor = concurrent.futures.ThreadPoolExecutor(max_workers=LAYER_WORKERS,
+                                                                    thread_name_prefix="layer")
+        return _layer_executor
+
+
+def hash_source(map_name):
+    """ Hash the contents of a .tmx file. This is what the cache is keyed by. """
+    with open(map_name, "rb") as source_file:
+        return hashlib.sha256(source_file.read()).digest()
+
+
+def cache_path(map_name, source_hash, cache_directory=CACHE_DIRECTORY):
+    """ Where the compiled copy of a map with this content hash lives. """
+    base_name = os.path.splitext(os.path.basename(map_name))[0]
+    return os.path.join(cache_directory, f"{base_name}-{source_hash.hex()[:16]}{CACHE_EXTENSION}")
+
+
+def _parse_color(color):
+    """ Convert a Tiled '#rrggbb' or '#aarrggbb' color to an (r, g, b) tuple. """
+    color = color.lstrip("#")
+    if len(color) == 8:
+        color = color[2:]
+    return int(color[0:2], 16), int(color[2:4], 16), int(color[4:6], 16)
+
+
+def _decode_layer_data(data_element, width, height):
+    """ Turn a <data> element into a flat list of gids. """
+    encoding = data_element.get("encoding")
+    compression = data_element.get("compression")
+    text = (data_element.text or "").strip()
+
+    if encoding == "csv":
+        gids = [int(value) for value in text.replace("\n", "").split(",") if value]
+    elif encoding == "base64":
+        raw = base64.b64decode(text)
+        if compression == "zlib":
+            raw = zlib.decompress(raw)
+        elif compression == "gzip":
+            raw = gzip.decompress(raw)
+        elif compression:
+            raise ValueError(f"Unsupported layer compression '{compression}'.")
+        gids = list(struct.unpack(f"<{len(raw) // 4}I", raw))
+    else:
+        raise ValueError(f"Unsupported layer encoding '{encoding}'. Use base64 or csv.")
+
+    if len(gids) != width * height:
+        raise ValueError(f"Layer data has {len(gids)} tiles, expected {width * height}.")
+    return gids
+
+
+def _read_layer(layer_element):
+    """ Decode a <layer> element into a CompiledLayer. """
+    width = int(layer_element.get("width"))
+    height = int(layer_element.get("height"))
+    return CompiledLayer(layer_element.get("name"),
+                         width,
+                         height,
+                         float(layer_element.get("opacity", 1)),
+                         _decode_layer_data(layer_element.find("data"), width, height))
+
+
+def _read_hit_box(object_element, width, height):
+    """
+    Hit box points for an object in a tile's objectgroup, relative to the
+    center of a width x height image with y up, the way arcade's
+    tilemap.process_layer() reads them. None for shapes that can't be one.
+    """
+    x = float(object_element.get("x", 0))
+    y = float(object_element.get("y", 0))
+    shape = object_element.find("polygon")
+    if shape is None:
+        shape = object_element.find("polyline")
+
+    if shape is not None:
+        points = []
+        for point in shape.get("points").split():
+            point_x, point_y = (float(value) for value in point.split(","))
+            points.append((point_x + x - width / 2, -(point_y + y - height / 2)))
+        # A closed polyline repeats its first point
+        if len(points) > 1 and points[0] == points[-1]:
+            points.pop()
+        return points
+
+    if object_element.get("width") is None or object_element.get("height") is None:
+        return None
+    object_width = float(object_element.get("width"))
+    object_height = float(object_element.get("height"))
+
+    if object_element.find("ellipse") is not None:
+        half_width = object_width / 2
+        half_height = object_height / 2
+        center_x = x + half_width - width / 2
+        center_y = y + half_height - height / 2
+        return [(half_width * math.cos(angle) + center_x,
+                 -(half_height * math.sin(angle) + center_y))
+                for angle in (step / 8 * 2 * math.pi for step in range(8))]
+
+    left = x - width / 2
+    top = -(y - height / 2)
+    right = x + object_width - width / 2
+    bottom = -(y + object_height - height / 2)
+    return [(left, top), (right, top), (right, bottom), (left, bottom)]
+
+
+def _image_path(source, directory):
+    """
+    Resolve a tile image path the way arcade.tilemap does: as given,
+    relative to the working directory, if that exists, else relative to
+    the map or tileset.
+    """
+    if os.path.exists(source):
+        return os.path.normpath(source)
+    return os.path.normpath(os.path.join(directory, source))
+
+
+def _read_tileset(tileset_element, first_gid, directory, tiles, hit_boxes):
+    """ Add the tiles of one tileset to the gid -> image table, and any hit boxes drawn on them. """
+    source = tileset_element.get("source")
+    if source:
+        # External .tsx tileset, image paths are relative to it
+        tileset_file = os.path.join(directory, source)
+        tileset_element = ElementTree.parse(tileset_file).getroot()
+        directory = os.path.dirname(tileset_file)
+
+    if tileset_element.find("image") is not None:
+        raise ValueError(f"Tileset '{tileset_element.get('name')}' is a sprite sheet. "
+                         "Tiles must be a collection of images.")
+
+    for tile_element in tileset_element.iter("tile"):
+        image_element = tile_element.find("image")
+        if image_element is None:
+            continue
+        image_file = _image_path(image_element.get("source"), directory)
+        gid = first_gid + int(tile_element.get("id"))
+        width = int(image_element.get("width", 0))
+        height = int(image_element.get("height", 0))
+        tiles[gid] = (image_file, width, height)
+
+        # arcade only supports one hit box per tile, and the last one wins
+        for object_element in tile_element.iterfind("objectgroup/object"):
+            points = _read_hit_box(object_element, width, height)
+            if points:
+                hit_boxes[gid] = points
+
+
+def _scan_source(map_name):
+    """
+    Stream through a .tmx file once, building no tree. Returns the <map>
+    attributes, a (tag, attributes, start, end) byte range for each of its
+    direct children, and the hash of the file.
+    """
+    parser = expat.ParserCreate()
+    map_attributes = {}
+    children = []
+    depth = 0
+    child = None
+
+    def start_element(tag, attributes):
+        nonlocal depth, child
+        if depth == 0:
+            map_attributes.update(attributes)
+        elif depth == 1:
+            child = (tag, attributes, parser.CurrentByteIndex)
+        depth += 1
+
+    def end_element(tag):
+        nonlocal depth
+        depth -= 1
+        if depth == 1:
+            children.append(child + (parser.CurrentByteIndex,))
+
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+
+    source_hash = hashlib.sha256()
+    with open(map_name, "rb") as source_file:
+        while True:
+            chunk = source_file.read(PARSE_CHUNK_SIZE)
+            source_hash.update(chunk)
+            parser.Parse(chunk, not chunk)
+            if not chunk:
+                break
+    return map_attributes, children, source_hash.digest()
+
+
+def _read_element(source_file, tag, start, end):
+    """
+    Parse one element out of an open file, from where its start tag begins
+    to where expat ended it: just past a self-closing tag, otherwise at the
+    start of its end tag.
+    """
+    source_file.seek(start)
+    data = source_file.read(end - start)
+    if not (data.endswith(b"/>") and data.find(b">") == len(data) - 1):
+        tail = source_file.read(len(tag) + 16)
+        data += tail[:tail.index(b">") + 1]
+    return ElementTree.fromstring(data)
+
+
+class LazyLevel(CompiledLevel):
+    """
+    A level read straight from a .tmx file, with its layers decoded on
+    demand. `layers` only holds the ones decoded so far.
+    """
+
+    def __init__(self, map_name):
+        map_attributes, children, source_hash = _scan_source(map_name)
+        directory = os.path.dirname(map_name)
+
+        background_color = None
+        if map_attributes.get("backgroundcolor"):
+            background_color = _parse_color(map_attributes["backgroundcolor"])
+
+        tiles = {}
+        hit_boxes = {}
+        # layer name -> (start, end) of its element in the file, in file order
+        self.layer_ranges = {}
+        with open(map_name, "rb") as source_file:
+            for tag, attributes, start, end in children:
+                if tag == "tileset":
+                    _read_tileset(_read_element(source_file, tag, start, end),
+                                  int(attributes["firstgid"]), directory, tiles, hit_boxes)
+                elif tag == "layer":
+                    self.layer_ranges[attributes["name"]] = (start, end)
+
+        super().__init__(map_name,
+                         source_hash,
+                         int(map_attributes["width"]),
+                         int(map_attributes["height"]),
+                         int(map_attributes["tilewidth"]),
+                         int(map_attributes["tileheight"]),
+                         background_color,
+                         tiles,
+                         {},
+                         hit_boxes)
+
+    def get_layer(self, layer_name):
+        """ Return the named layer, decoding it if need be, or None if the map doesn't have one. """
+        layer = self.layers.get(layer_name)
+        if layer is None and layer_name in self.layer_ranges:
+            layer = self._decode_layer(layer_name)
+        return layer
+
+    def _decode_layer(self, layer_name):
+        """ Read and decode one layer from the file. """
+        start, end = self.layer_ranges[layer_name]
+        with open(self.source, "rb") as source_file:
+            layer = _read_layer(_read_element(source_file, "layer", start, end))
+        self.layers[layer_name] = layer
+        return layer
+
+    def decode_layers(self):
+        """ Decode every layer not decoded yet, side by side on the layer threads. """
+        missing = [layer_name for layer_name in self.layer_ranges
+                   if layer_name not in self.layers]
+        for _ in layer_executor().map(self._decode_layer, missing):
+            pass
+        # Back in file order, which is the order they're drawn in
+        self.layers = {layer_name: self.layers[layer_name] for layer_name in self.layer_ranges}
+
+
+def read_source(map_name):
+    """ Parse a .tmx file directly, without touching the cache, and decode every layer. """
+    level = LazyLevel(map_name)
+    level.decode_layers()
+    return level
+
+
+def _pad(data):
+    """ Keep the next block 4-byte aligned so gid arrays can be viewed in place. """
+    data.extend(b"\0" * (-len(data) % 4))
+
+
+def write_level(level, file_name):
+    """ Write a level out in the compiled format. """
+    red, green, blue = level.background_color or (0, 0, 0)
+    data = bytearray(_HEADER.pack(CACHE_MAGIC,
+                                  CACHE_VERSION,
+                                  level.map_width,
+                                  level.map_height,
+                                  level.tile_width,
+                                  level.tile_height,
+                                  level.background_color is not None,
+                                  red, green, blue,
+                                  len(level.tiles),
+                                  len(level.layers),
+                                  level.source_hash))
+
+    for gid, (image_file, width, height) in sorted(level.tiles.items()):
+        encoded_name = image_file.encode("utf-8")
+        hit_box = level.hit_boxes.get(gid, ())
+        data.extend(_TILE.pack(gid, width, height, len(encoded_name), len(hit_box)))
+        data.extend(encoded_name)
+        data.extend(struct.pack(f"<{len(hit_box) * 2}f",
+                                *(value for point in hit_box for value in point)))
+
+    for layer in level.layers.values():
+        _pad(data)
+        encoded_name = layer.name.encode("utf-8")
+        data.extend(_LAYER.pack(len(encoded_name), layer.width, layer.height, layer.opacity))
+        data.extend(encoded_name)
+        _pad(data)
+        data.extend(struct.pack(f"<{len(layer.gids)}I", *layer.gids))
+
+    # Write to a temporary name first so a half written file is never picked up
+    temporary_name = file_name + ".tmp"
+    with open(temporary_name, "wb") as cache_file:
+        cache_file.write(data)
+    os.replace(temporary_name, file_name)
+
+
+def read_level(file_name, source=None):
+    """ Memory-map a compiled level. Layer gids are views straight into the file. """
+    with open(file_name, "rb") as cache_file:
+        mapped = mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+
+    (magic, version, map_width, map_height, tile_width, tile_height,
+     has_background, red, green, blue, tile_count, layer_count,
+     source_hash) = _HEADER.unpack_from(view)
+    if magic != CACHE_MAGIC or version != CACHE_VERSION:
+        raise ValueError(f"'{file_name}' is not a version {CACHE_VERSION} compiled level.")
+
+    offset = _HEADER.size
+    tiles = {}
+    hit_boxes = {}
+    for _ in range(tile_count):
+        gid, width, height, name_length, point_count = _TILE.unpack_from(view, offset)
+        offset += _TILE.size
+        tiles[gid] = (bytes(view[offset:offset + name_length]).decode("utf-8"), width, height)
+        offset += name_length
+        if point_count:
+            values = struct.unpack_from(f"<{point_count * 2}f", view, offset)
+            hit_boxes[gid] = list(zip(values[0::2], values[1::2]))
+        offset += point_count * 8
+
+    layers = {}
+    for _ in range(layer_count):
+        offset += -offset % 4
+        name_length, width, height, opacity = _LAYER.unpack_from(view, offset)
+        offset += _LAYER.size
+        name = bytes(view[offset:offset + name_length]).decode("utf-8")
+        offset += name_length
+        offset += -offset % 4
+        gids = view[offset:offset + width * height * 4].cast("I")
+        offset += width * height * 4
+        layers[name] = CompiledLayer(name, width, height, opacity, gids)
+
+    background_color = (red, green, blue) if has_background else None
+    return CompiledLevel(source or file_name, source_hash, map_width, map_height,
+                         tile_width, tile_height, background_color, tiles, layers, hit_boxes)
+
+
+def compile_level(map_name, cache_directory=CACHE_DIRECTORY):
+    """ Compile one .tmx file into the cache, and drop stale copies of it. """
+    level = read_source(map_name)
+    os.makedirs(cache_directory, exist_ok=True)
+    file_name = cache_path(map_name, level.source_hash, cache_directory)
+    write_level(level, file_name)
+
+    base_name = os.path.splitext(os.path.basename(map_name))[0]
+    for old_file in glob.glob(os.path.join(cache_directory, f"{base_name}-*{CACHE_EXTENSION}")):
+        if old_file != file_name:
+            try:
+                os.remove(old_file)
+            except OSError:
+                # Probably still mapped by a running game, next compile gets it
+                pass
+    return file_name
+
+
+def load_level(map_name, cache_directory=CACHE_DIRECTORY):
+    """
+    Load a level through the cache. If the .tmx changed since it was
+    compiled, the hash won't match any cache file and it gets recompiled.
+    """
+    file_name = cache_path(map_name, hash_source(map_name), cache_directory)
+    if not os.path.exists(file_name):
+        file_name = compile_level(map_name, cache_directory)
+    try:
+        return read_level(file_name, map_name)
+    except ValueError:
+        # Written by an older version of this module
+        return read_level(compile_level(map_name, cache_directory), map_name)
+
+
+def process_layer(level, layer_name, scaling=1, use_spatial_hash=None, owner=None):
+    """
+    Create the sprites for a layer of a compiled level. Works like
+    arcade.tilemap.process_layer() does for a map from read_tmx().
+    """
+    import sprite_pool
+
+    sprite_list = sprite_pool.pool.sprite_list(layer_name, use_spatial_hash)
+    sprite_list.extend(layer_sprites(level, layer_name, scaling, owner=owner))
+    return sprite_list
+
+
+def process_layers(level, layers, scaling=1, owner=None):
+    """
+    process_layer() for several layers at once, given as {layer name:
+    use_spatial_hash}. The sprites are built on the layer threads, and
+    put into their lists on the calling thread.
+    """
+    import sprite_pool
+
+    built = build_layers(level, layers, scaling, owner=owner)
+    sprite_lists = {}
+    for layer_name, use_spatial_hash in layers.items():
+        sprite_list = sprite_pool.pool.sprite_list(layer_name, use_spatial_hash)
+        sprite_list.extend(built[layer_name])
+        sprite_lists[layer_name] = sprite_list
+    return sprite_lists
+
+
+def build_layers(level, layer_names, scaling=1, columns=None, owner=None):
+    """ layer_sprites() for several layers, each on a layer thread. Returns {name: sprites}. """
+    executor = layer_executor()
+    futures = {layer_name: executor.submit(layer_sprites, level, layer_name, scaling, columns,
+                                           owner)
+               for layer_name in layer_names}
+    return {layer_name: future.result() for layer_name, future in futures.items()}
+
+
+def layer_sprites(level, layer_name, scaling=1, columns=None, owner=None):
+    """
+    A list of sprites for a layer of a compiled level, for every column or
+    only the columns in a range. Sprites come out in the same order as
+    process_layer() makes them. Their textures come from the shared
+    texture_cache, held by owner. Hit boxes drawn in the tileset are used
+    over the ones worked out from the images.
+    """
+    import texture_cache
+
+    layer = level.get_layer(layer_name)
+    if layer is None:
+        print(f"Warning, no layer named '{layer_name}'.")
+        return []
+
+    if columns is None:
+        columns = range(layer.width)
+    columns = range(max(columns.start, 0), min(columns.stop, layer.width))
+
+    sprites = []
+    tile_width = level.tile_width * scaling
+    tile_height = level.tile_height * scaling
+    gids = layer.gids
+
+    for row in range(layer.height):
+        row_start = row * layer.width
+        for column in columns:
+            gid = gids[row_start + column]
+            if gid == 0:
+                continue
+
+            tile = level.tiles.get(gid & GID_MASK)
+            if tile is None:
+                raise ValueError(f"Warning, couldn't find tile for item {gid} in layer "
+                                 f"'{layer_name}' in file '{level.source}'.")
+
+            my_sprite = texture_cache.make_sprite(tile[0], scaling,
+                                                  bool(gid & FLIPPED_HORIZONTALLY_FLAG),
+                                                  bool(gid & FLIPPED_VERTICALLY_FLAG),
+                                                  bool(gid & FLIPPED_DIAGONALLY_FLAG),
+                                                  owner=owner,
+                                                  hit_box=level.hit_boxes.get(gid & GID_MASK))
+            my_sprite.center_x = column * tile_width + my_sprite.width / 2
+            my_sprite.center_y = (level.map_height - row - 1) * tile_height + my_sprite.height / 2
+
+            if layer.opacity < 1:
+                my_sprite.alpha = int(layer.opacity * 255)
+
+            sprites.append(my_sprite)
+
+    return sprites
+
+
+def main():
+    """ Compile every map in tmx_map/ """
+    map_names = sys.argv[1:] or sorted(glob.glob("tmx_map/*.tmx"))
+    for map_name in map_names:
+        file_name = compile_level(map_name)
+        print(f"{map_name} -> {file_name} ({os.path.getsize(file_name)} bytes)")
+
+
+if __name__ == "__main__":
+    main()
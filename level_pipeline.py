@@ -0,0 +1,256 @@
+"""
+Background level loading
+
+While a level is being played, the next one is parsed and its sprite lists
+are built on a worker thread, so reaching the end of the map only has to
+swap the finished lists in.
+
+Layers the simulation needs, the platforms, coins and hazards, are built
+with the level. The background and foreground are only built the first
+time something asks for them, so nothing that doesn't draw them, like a
+headless run or a replay, ever pays for their textures. When they are
+baked, they are baked from compact tile_layer.TileLayers, so they never
+become sprites at all.
+
+A streamed level builds its layers a chunk at a time around the viewport
+instead, see streaming.py. Streamed layers are never baked.
+
+Every level's textures come from the shared texture_cache. A level owns
+the ones it uses until release() is called, once it's been replaced,
+which also gives its sprites and lists back to the sprite_pool.
+"""
+import concurrent.futures
+import os
+import time
+
+import baking
+import grid_collision
+import hitbox_cache
+import level_cache
+import sprite_pool
+import streaming
+import texture_cache
+import tile_layer
+
+MAP_NAME = "tmx_map/funhouse_level_{}.tmx"
+
+PLATFORMS_LAYER_NAME = 'Platforms'
+COINS_LAYER_NAME = 'Coins'
+FOREGROUND_LAYER_NAME = 'Foreground'
+BACKGROUND_LAYER_NAME = 'Background'
+DONT_TOUCH_LAYER_NAME = "Don't Touch"
+
+
+class LoadedLevel:
+    """ Everything setup() needs from a map, ready to swap in. """
+
+    def __init__(self, level, my_map, scaling, bake_static_layers=False, load_times=None,
+                 stream_level=False):
+        self.level = level
+        self.my_map = my_map
+        self.scaling = scaling
+        self.background_color = my_map.background_color
+        self.end_of_map = my_map.map_width * my_map.tile_width * scaling
+
+        # (what, start, end) in perf_counter() seconds, for the startup timeline
+        self.load_times = load_times if load_times is not None else []
+
+        # layer name -> SpriteList, for the layers built so far
+        self.sprite_lists = {}
+
+        # layer name -> grid_collision.TileGrid, for the grids built so far
+        self.tile_grids = {}
+
+        # layer name -> baking.BakedLayer, for layers that never move
+        self.baked_layers = {}
+
+        self.streaming_level = None
+        if stream_level:
+            self.streaming_level = streaming.StreamingLevel(my_map,
+                                                            {PLATFORMS_LAYER_NAME: True,
+                                                             COINS_LAYER_NAME: True,
+                                                             DONT_TOUCH_LAYER_NAME: True,
+                                                             BACKGROUND_LAYER_NAME: None,
+                                                             FOREGROUND_LAYER_NAME: None},
+                                                            scaling, owner=self)
+            # The first chunks, at least. setup() streams in the rest for the viewport.
+            start_time = time.perf_counter()
+            self.stream(0, self.streaming_level.chunk_width)
+            self.load_times.append(("stream first chunks", start_time, time.perf_counter()))
+        else:
+            # Built side by side, see level_cache.process_layers()
+            self.build_layers({PLATFORMS_LAYER_NAME: True,
+                               COINS_LAYER_NAME: True,
+                               DONT_TOUCH_LAYER_NAME: True})
+            self.wall_list = self.sprite_lists[PLATFORMS_LAYER_NAME]
+            self.coin_list = self.sprite_lists[COINS_LAYER_NAME]
+            self.dont_touch_list = self.sprite_lists[DONT_TOUCH_LAYER_NAME]
+
+            if bake_static_layers:
+                # The platforms are sprites already, for the physics
+                for layer_name, placements in (
+                        (BACKGROUND_LAYER_NAME, self.tile_layer(BACKGROUND_LAYER_NAME).placements()),
+                        (PLATFORMS_LAYER_NAME, baking.sprite_placements(self.wall_list)),
+                        (FOREGROUND_LAYER_NAME, self.tile_layer(FOREGROUND_LAYER_NAME).placements())):
+                    start_time = time.perf_counter()
+                    self.baked_layers[layer_name] = baking.BakedLayer(layer_name, placements)
+                    self.load_times.append((f"bake {layer_name}", start_time, time.perf_counter()))
+
+    def build_layers(self, layers):
+        """ Build the sprite lists of {layer name: use_spatial_hash} that aren't built yet. """
+        layers = {layer_name: use_spatial_hash for layer_name, use_spatial_hash in layers.items()
+                  if layer_name not in self.sprite_lists}
+        if not layers:
+            return
+        start_time = time.perf_counter()
+        self.sprite_lists.update(level_cache.process_layers(self.my_map, layers, self.scaling,
+                                                            owner=self))
+        # Keep any hit boxes that had to be worked out for next time
+        hitbox_cache.hit_boxes.save()
+        self.load_times.append((f"layers {', '.join(layers)}", start_time, time.perf_counter()))
+
+    def sprite_list(self, layer_name, use_spatial_hash=None):
+        """ The sprites of a layer, built the first time they are asked for. """
+        self.build_layers({layer_name: use_spatial_hash})
+        return self.sprite_lists[layer_name]
+
+    def stream(self, view_left, view_width):
+        """
+        Load and drop chunks of a streamed level for the viewport. Returns
+        True if that changed the layers' sprite lists.
+        """
+        if not self.streaming_level.update(view_left, view_width):
+            return False
+        hitbox_cache.hit_boxes.save()
+        self.sprite_lists.update(self.streaming_level.sprite_lists)
+        self.wall_list = self.sprite_lists[PLATFORMS_LAYER_NAME]
+        self.coin_list = self.sprite_lists[COINS_LAYER_NAME]
+        self.dont_touch_list = self.sprite_lists[DONT_TOUCH_LAYER_NAME]
+        return True
+
+    def replace_sprite_list(self, layer_name, sprite_list):
+        """
+        Use a new sprite list for a layer, like the coins once they've been
+        compacted. The old one goes back to the sprite_pool.
+        """
+        old_list = self.sprite_lists[layer_name]
+        self.sprite_lists[layer_name] = sprite_list
+        if self.streaming_level is not None:
+            self.streaming_level.replace_list(layer_name, sprite_list)
+        self.wall_list = self.sprite_lists[PLATFORMS_LAYER_NAME]
+        self.coin_list = self.sprite_lists[COINS_LAYER_NAME]
+        self.dont_touch_list = self.sprite_lists[DONT_TOUCH_LAYER_NAME]
+        sprite_pool.pool.recycle_list(old_list, layer_name)
+
+    def tile_layer(self, layer_name):
+        """ A layer as a compact tile_layer.TileLayer. Made fresh each call, nothing keeps it. """
+        start_time = time.perf_counter()
+        layer = tile_layer.TileLayer(self.my_map, layer_name, self.scaling, owner=self)
+        self.load_times.append((f"tile layer {layer_name}", start_time, time.perf_counter()))
+        return layer
+
+    def tile_grid(self, layer_name):
+        """ Which cells of a layer have a tile in them, built the first time it's asked for. """
+        tile_grid = self.tile_grids.get(layer_name)
+        if tile_grid is None:
+            tile_grid = grid_collision.TileGrid.from_layer(self.my_map, layer_name, self.scaling)
+            self.tile_grids[layer_name] = tile_grid
+        return tile_grid
+
+    def release(self):
+        """
+        Done with this level. Its textures can be evicted once no other level
+        uses them, and its sprite lists and sprites go back to the pool.
+        Nothing may use its lists after this.
+        """
+        texture_cache.cache.release(self)
+        for layer_name, sprite_list in self.sprite_lists.items():
+            sprite_pool.pool.recycle_list(sprite_list, layer_name)
+        self.sprite_lists = {}
+        self.wall_list = None
+        self.coin_list = None
+        self.dont_touch_list = None
+
+    @property
+    def background_list(self):
+        """ Built on first use. """
+        return self.sprite_list(BACKGROUND_LAYER_NAME)
+
+    @property
+    def foreground_list(self):
+        """ Built on first use. """
+        return self.sprite_list(FOREGROUND_LAYER_NAME)
+
+
+def load_level(level, scaling, bake_static_layers=False, stream_level=False):
+    """ Load a level and build its sprite lists. Safe to call off the main thread. """
+    map_name = MAP_NAME.format(level)
+    start_time = time.perf_counter()
+    my_map = level_cache.load_level(map_name)
+    load_times = [(f"read {map_name}", start_time, time.perf_counter())]
+    return LoadedLevel(level, my_map, scaling, bake_static_layers, load_times, stream_level)
+
+
+def release_future(future):
+    """ Release the level a stale load made, once it's finished. """
+    if not future.cancelled() and future.exception() is None:
+        future.result().release()
+
+
+class LevelPipeline:
+    """
+    Loads levels ahead of time on a single worker thread.
+
+    Nothing in here touches OpenGL: arcade only uploads textures the first
+    time a sprite list is drawn, which has to happen on the main thread.
+    """
+
+    def __init__(self, scaling, bake_static_layers=False, stream_level=False):
+        self.scaling = scaling
+        self.bake_static_layers = bake_static_layers
+        self.stream_level = stream_level
+        self.pending = {}
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+        # How long the last take() blocked the game loop, in seconds
+        self.last_wait = 0.0
+
+    def prefetch(self, level):
+        """ Start loading a level in the background, if there is one. """
+        if level in self.pending or not os.path.exists(MAP_NAME.format(level)):
+            return
+        self.pending[level] = self.executor.submit(load_level, level, self.scaling,
+                                                   self.bake_static_layers, self.stream_level)
+
+    def ready(self, level):
+        """ Would take() return without waiting? """
+        future = self.pending.get(level)
+        return future is None or future.done()
+
+    def take(self, level):
+        """
+        Hand over a loaded level. Waits for the worker if it's still busy,
+        or loads right here if the level was never prefetched.
+        """
+        start_time = time.perf_counter()
+        future = self.pending.pop(level, None)
+        if future is None:
+            loaded = load_level(level, self.scaling, self.bake_static_layers, self.stream_level)
+        else:
+            loaded = future.result()
+
+        # Anything else queued is stale now
+        for stale in self.pending.values():
+            if not stale.cancel():
+                stale.add_done_callback(release_future)
+        self.pending.clear()
+
+        self.last_wait = time.perf_counter() - start_time
+        return loaded
+
+    def shutdown(self):
+        """ Stop the worker thread. """
+        for future in self.pending.values():
+            future.cancel()
+        self.pending.clear()
+        self.executor.shutdown(wait=False)
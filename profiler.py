@@ -0,0 +1,102 @@
+"""
+Per-phase frame profiling
+
+Wrap each phase of a frame in start()/stop() calls. While the profiler is
+off both calls return straight away, so they can stay in the game loop.
+While it is on, every frame's phase times go into rolling histories that
+give p50/p95/p99, and optionally into a JSON lines log, one object per
+frame with times in milliseconds.
+"""
+import collections
+import json
+import time
+
+# How many frames of history the percentiles are taken over
+PROFILE_HISTORY = 600
+
+
+class FrameProfiler:
+    """ Times named phases of each frame. """
+
+    def __init__(self, history=PROFILE_HISTORY):
+        self.enabled = False
+        self.history = history
+
+        # phase name -> deque of recent per-frame times, in seconds
+        self.samples = {}
+
+        self.current_frame = {}
+        self.frame_count = 0
+        self.last_frame_end = None
+        self.log_file = None
+
+    def start(self):
+        """ Mark the start of a phase. Pass the result to stop(). """
+        if not self.enabled:
+            return 0.0
+        return time.perf_counter()
+
+    def stop(self, phase, start_time):
+        """ Add the time since start() to this frame's total for a phase. """
+        if not self.enabled:
+            return
+        elapsed = time.perf_counter() - start_time
+        self.current_frame[phase] = self.current_frame.get(phase, 0.0) + elapsed
+
+    def end_frame(self):
+        """ Close out the frame: store its phase times and log them. """
+        if not self.enabled:
+            return
+
+        now = time.perf_counter()
+        if self.last_frame_end is not None:
+            self.current_frame["frame"] = now - self.last_frame_end
+        self.last_frame_end = now
+
+        for phase, elapsed in self.current_frame.items():
+            if phase not in self.samples:
+                self.samples[phase] = collections.deque(maxlen=self.history)
+            self.samples[phase].append(elapsed)
+
+        if self.log_file is not None:
+            record = {phase: round(elapsed * 1000, 4) for phase, elapsed in self.current_frame.items()}
+            record["frame_number"] = self.frame_count
+            self.log_file.write(json.dumps(record) + "\n")
+
+        self.frame_count += 1
+        self.current_frame = {}
+
+    def toggle(self):
+        """ Turn profiling on or off. History is kept, but the frame gap isn't. """
+        self.enabled = not self.enabled
+        self.current_frame = {}
+        self.last_frame_end = None
+
+    def open_log(self, file_name):
+        """ Start writing every profiled frame to a JSON lines file. """
+        self.log_file = open(file_name, "w")
+
+    def close_log(self):
+        """ Stop logging, if we were. """
+        if self.log_file is not None:
+            self.log_file.close()
+            self.log_file = None
+
+    def percentiles(self, phase):
+        """ Return the (p50, p95, p99) of a phase over the recent history, in seconds. """
+        samples = sorted(self.samples.get(phase, ()))
+        if not samples:
+            return 0.0, 0.0, 0.0
+        last_index = len(samples) - 1
+        return (samples[round(last_index * 0.50)],
+                samples[round(last_index * 0.95)],
+                samples[round(last_index * 0.99)])
+
+    def report(self):
+        """ One line of text per phase, slowest p95 first. """
+        rows = [(phase, self.percentiles(phase)) for phase in self.samples]
+        rows.sort(key=lambda row: row[1][1], reverse=True)
+        lines = [f"{'phase':<28}{'p50':>8}{'p95':>8}{'p99':>8}  ms"]
+        for phase, (p50, p95, p99) in rows:
+            lines.append(f"{phase:<28}{p50 * 1000:>8.3f}{p95 * 1000:>8.3f}{p99 * 1000:>8.3f}")
+        return lines
@@ -0,0 +1,187 @@
+"""
+Input recording and replay
+
+A replay stores the four input flags for every fixed step of the simulation,
+one byte per tick. Every `hash_interval` ticks the byte is followed by a
+hash of the game state, so a replay that drifts from the original run is
+caught close to where it happened.
+
+Record a session with `python round1.py --record session.rpl`, then play it
+back headless, as fast as the machine allows, with:
+
+    python replay.py session.rpl
+"""
+import hashlib
+import struct
+import sys
+import time
+
+import simulation
+
+REPLAY_MAGIC = b"FHRP"
+REPLAY_VERSION = 1
+
+# magic, version, start level, hash interval, timestep
+_HEADER = struct.Struct("<4sBBHf")
+
+UP_FLAG = 0x01
+DOWN_FLAG = 0x02
+LEFT_FLAG = 0x04
+RIGHT_FLAG = 0x08
+HASH_FLAG = 0x80
+
+HASH_SIZE = 8
+DEFAULT_HASH_INTERVAL = 60
+DEFAULT_TIMESTEP = 1 / 60
+
+
+def input_mask(sim):
+    """ Pack the simulation's input flags into one byte. """
+    return ((UP_FLAG if sim.up_pressed else 0)
+            | (DOWN_FLAG if sim.down_pressed else 0)
+            | (LEFT_FLAG if sim.left_pressed else 0)
+            | (RIGHT_FLAG if sim.right_pressed else 0))
+
+
+def apply_input_mask(sim, mask):
+    """ Set the simulation's input flags from a byte written by input_mask(). """
+    sim.up_pressed = bool(mask & UP_FLAG)
+    sim.down_pressed = bool(mask & DOWN_FLAG)
+    sim.left_pressed = bool(mask & LEFT_FLAG)
+    sim.right_pressed = bool(mask & RIGHT_FLAG)
+
+
+def state_hash(sim):
+    """ A short hash of everything that should match between a run and its replay. """
+    player = sim.player_sprite
+    state = struct.pack("<ddddiiiii",
+                        player.center_x,
+                        player.center_y,
+                        player.change_x,
+                        player.change_y,
+                        sim.score,
+                        sim.level,
+                        sim.coins.remaining,
+                        sim.view_left,
+                        sim.view_bottom)
+    return hashlib.blake2b(state, digest_size=HASH_SIZE).digest()
+
+
+class InputRecorder:
+    """ Writes the input state of every tick to a binary stream. """
+
+    def __init__(self, stream, start_level, timestep=DEFAULT_TIMESTEP,
+                 hash_interval=DEFAULT_HASH_INTERVAL):
+        self.stream = stream
+        self.hash_interval = hash_interval
+        self.tick = 0
+        stream.write(_HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION, start_level,
+                                  hash_interval, timestep))
+
+    def record(self, sim):
+        """ Call right before the simulation runs a tick. """
+        if self.tick % self.hash_interval == 0:
+            self.stream.write(bytes((input_mask(sim) | HASH_FLAG,)))
+            self.stream.write(state_hash(sim))
+        else:
+            self.stream.write(bytes((input_mask(sim),)))
+        self.tick += 1
+
+    def close(self):
+        """ Flush and close the stream. """
+        self.stream.close()
+
+
+class Replay:
+    """ A recording read back into memory. """
+
+    def __init__(self, start_level, hash_interval, timestep, ticks):
+        self.start_level = start_level
+        self.hash_interval = hash_interval
+        self.timestep = timestep
+
+        # One (input mask, state hash or None) pair per tick
+        self.ticks = ticks
+
+
+def read_replay(file_name):
+    """ Load a replay file. """
+    with open(file_name, "rb") as replay_file:
+        data = replay_file.read()
+
+    magic, version, start_level, hash_interval, timestep = _HEADER.unpack_from(data)
+    if magic != REPLAY_MAGIC or version != REPLAY_VERSION:
+        raise ValueError(f"'{file_name}' is not a version {REPLAY_VERSION} replay.")
+
+    ticks = []
+    offset = _HEADER.size
+    while offset < len(data):
+        mask = data[offset]
+        offset += 1
+        recorded_hash = None
+        if mask & HASH_FLAG:
+            recorded_hash = data[offset:offset + HASH_SIZE]
+            offset += HASH_SIZE
+        ticks.append((mask & ~HASH_FLAG, recorded_hash))
+
+    return Replay(start_level, hash_interval, timestep, ticks)
+
+
+class ReplayResult:
+    """ What happened when a replay was played back. """
+
+    def __init__(self, ticks, elapsed, desyncs, timestep):
+        self.ticks = ticks
+        self.elapsed = elapsed
+
+        # Tick numbers where the state hash didn't match the recording
+        self.desyncs = desyncs
+
+        self.timestep = timestep
+
+    @property
+    def speedup(self):
+        """ How many times faster than real time the replay ran. """
+        if self.elapsed == 0:
+            return 0
+        return self.ticks * self.timestep / self.elapsed
+
+
+def play_replay(replay, stop_on_desync=False):
+    """ Run a replay through a fresh headless simulation, one fixed step per tick, unthrottled. """
+    sim = simulation.GameSimulation(physics_rate=round(1 / replay.timestep))
+    sim.setup(replay.start_level)
+
+    desyncs = []
+    ticks_run = 0
+    start_time = time.perf_counter()
+    for tick, (mask, recorded_hash) in enumerate(replay.ticks):
+        if recorded_hash is not None and state_hash(sim) != recorded_hash:
+            desyncs.append(tick)
+            if stop_on_desync:
+                break
+        apply_input_mask(sim, mask)
+        sim.step()
+        sim.sound_events.clear()
+        ticks_run += 1
+    elapsed = time.perf_counter() - start_time
+
+    return ReplayResult(ticks_run, elapsed, desyncs, replay.timestep)
+
+
+def main():
+    """ Play back a replay file and report speed and desyncs """
+    if len(sys.argv) != 2:
+        print("Usage: python replay.py <replay file>")
+        sys.exit(2)
+
+    result = play_replay(read_replay(sys.argv[1]))
+    print(f"{result.ticks} ticks in {result.elapsed:.2f}s ({result.speedup:.0f}x real time)")
+    if result.desyncs:
+        print(f"Desync at ticks: {', '.join(str(tick) for tick in result.desyncs)}")
+        sys.exit(1)
+    print("No desyncs")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,269 +1,315 @@
 """
 Platformer Game
 """
-import arcade
-
-SCREEN_WIDTH = 1000
-SCREEN_HEIGHT = 650
-SCREEN_TITLE = "Priya's 2D Funhouse"
+import argparse
 
-CHARACTER_SCALING = 1
-TILE_SCALING = 0.5
-COIN_SCALING = 0.5
-SPRITE_PIXEL_SIZE = 128
-GRID_PIXEL_SIZE = (SPRITE_PIXEL_SIZE * TILE_SCALING)
+# First, so the startup timeline covers the imports too
+import startup
 
-PLAYER_MOVEMENT_SPEED = 3
-PLAYER_JUMP_SPEED = 13
-GRAVITY = 0.8
+import_start_time = startup.timeline.start()
+import arcade
+startup.timeline.stop("import arcade", import_start_time)
+
+import_start_time = startup.timeline.start()
+import audio
+import compositor
+import culling
+import hud
+import level_pipeline
+import replay
+import simulation
+import sprite_pool
+import texture_cache
+startup.timeline.stop("import game modules", import_start_time)
+
+SCREEN_WIDTH = simulation.SCREEN_WIDTH
+SCREEN_HEIGHT = simulation.SCREEN_HEIGHT
+SCREEN_TITLE = "Priya's 2D Funhouse"
 
-LEFT_VIEWPORT_MARGIN = 200
-RIGHT_VIEWPORT_MARGIN = 200
-BOTTOM_VIEWPORT_MARGIN = 150
-TOP_VIEWPORT_MARGIN = 100
+# Frames per second to draw. Physics runs at simulation.PHYSICS_RATE regardless.
+RENDER_RATE = 60
 
-PLAYER_START_X = 64
-PLAYER_START_Y = 225
+# Seconds between refreshes of the profiler overlay text
+PROFILE_OVERLAY_REFRESH = 0.5
 
 
 class MyGame(arcade.Window):
     """
-    Main application class.
+    Main application class. Draws the simulation and feeds it keyboard input.
     """
 
-    def __init__(self):
+    def __init__(self, stream_level=False):
+
+        # Start loading the first level before opening the window, so the two overlap.
+        # A streamed level changes its sprite lists as it scrolls, so it can't be baked.
+        self.sim = simulation.GameSimulation(bake_static_layers=not stream_level,
+                                             stream_level=stream_level)
+        self.sim.level_pipeline.prefetch(self.sim.level)
+
+        start_time = startup.timeline.start()
+        super().__init__(SCREEN_WIDTH, SCREEN_HEIGHT, SCREEN_TITLE,
+                         update_rate=1 / RENDER_RATE)
+        startup.timeline.stop("window creation", start_time)
+
+        # Until the first level has loaded, frames only show the loading text
+        self.level_loaded = False
+        self.first_frame_drawn = False
+        self.startup_reported = False
+        self.startup_log = None
+
+        # The viewport and background color last sent to arcade
+        self.viewport = (0, 0)
+        self.background_color = None
+
+        self.profile_refresh_timer = 0
+
+        self.hud = hud.Hud(SCREEN_WIDTH, SCREEN_HEIGHT)
+        self.hud.add_text("score", 10, 10, arcade.csscolor.BLACK, 18)
+        self.hud.add_text("loading", SCREEN_WIDTH / 2 - 60, SCREEN_HEIGHT / 2,
+                          arcade.csscolor.WHITE, 24)
+        self.profile_line_count = 0
+
+        # layer name -> culling.CulledLayer for the current level's sprite list
+        self.culled_layers = {}
+        self.culled_level = None
+        # The streamed level's change_count when the culled layers were last indexed
+        self.culled_change_count = 0
+
+        # Draw order, bottom to top
+        self.compositor = compositor.RenderCompositor(self.sim.profiler)
+        # Static layers take a getter, so a baked layer never builds its sprite list
+        self.compositor.add_layer("background",
+                                  lambda: self.static_layer(level_pipeline.BACKGROUND_LAYER_NAME,
+                                                            lambda: self.sim.background_list))
+        self.compositor.add_layer("platforms",
+                                  lambda: self.static_layer(level_pipeline.PLATFORMS_LAYER_NAME,
+                                                            lambda: self.sim.wall_list))
+        self.compositor.add_layer("coins",
+                                  lambda: self.culled_layer(level_pipeline.COINS_LAYER_NAME,
+                                                            self.sim.coin_list))
+        self.compositor.add_layer("don't touch",
+                                  lambda: self.culled_layer(level_pipeline.DONT_TOUCH_LAYER_NAME,
+                                                            self.sim.dont_touch_list))
+        self.compositor.add_layer("player", lambda: self.sim.player_list)
+        self.compositor.add_layer("foreground",
+                                  lambda: self.static_layer(level_pipeline.FOREGROUND_LAYER_NAME,
+                                                            lambda: self.sim.foreground_list))
+
+        # Decoded in the background, the game's own sounds first
+        start_time = startup.timeline.start()
+        self.audio = audio.AudioManager()
+        self.audio.add_sound(simulation.COIN_SOUND, "sounds/coin1.wav", preload=True)
+        self.audio.add_sound(simulation.JUMP_SOUND, "sounds/jump1.wav", voices=2, preload=True)
+        self.audio.add_sound(simulation.GAME_OVER_SOUND, "sounds/gameover1.wav", voices=1,
+                             min_interval=0.5, preload=True)
+        self.audio.add_directory("sounds")
+        startup.timeline.stop("start audio thread", start_time)
 
-        super().__init__(SCREEN_WIDTH, SCREEN_HEIGHT, SCREEN_TITLE)
+    def setup(self, level):
+        """ Set up the game here. Call this function to restart the game. """
 
+        self.sim.setup(level)
+        self.sync_with_simulation()
+
+    def finish_loading(self):
+        """ Start the first level, once the pipeline has it ready. """
+
+        self.setup(self.sim.level)
+        for name, start_time, end_time in self.sim.loaded_level.load_times:
+            startup.timeline.add(name, start_time, end_time)
+        self.hud.set_text("loading", "")
+        self.level_loaded = True
+
+    def report_startup(self):
+        """ Print the startup timeline, and save it if asked to. """
+
+        startup.timeline.mark("first level frame")
+        print("Startup timeline:")
+        for line in startup.timeline.report():
+            print(line)
+        if self.startup_log:
+            startup.timeline.write(self.startup_log)
+
+    def static_layer(self, layer_name, get_sprite_list):
+        """
+        The baked copy of a layer if there is one, otherwise its culled
+        sprite list, which get_sprite_list() is only called for then.
+        """
+        baked_layer = self.sim.baked_layers.get(layer_name)
+        if baked_layer is not None:
+            return baked_layer
+        return self.culled_layer(layer_name, get_sprite_list())
+
+    def culled_layer(self, layer_name, sprite_list):
+        """ A culled view of a sprite list, made again when a new level replaces the list. """
+        if self.culled_level is not self.sim.loaded_level:
+            # The new level's lists may be the old level's list objects, reused
+            for culled_layer in self.culled_layers.values():
+                culled_layer.release()
+            self.culled_layers = {}
+            self.culled_level = self.sim.loaded_level
+
+        # A streamed level adds and drops sprites in its lists as it scrolls
+        streaming_level = self.sim.loaded_level.streaming_level
+        if streaming_level is not None and streaming_level.change_count != self.culled_change_count:
+            for culled_layer in self.culled_layers.values():
+                culled_layer.rebuild_index()
+            self.culled_change_count = streaming_level.change_count
+
+        culled_layer = self.culled_layers.get(layer_name)
+        if culled_layer is None or culled_layer.source is not sprite_list:
+            # Coin compaction replaces the coin list. Unregister the old
+            # selection, or its sprites would stay in it and never be pooled.
+            if culled_layer is not None:
+                culled_layer.release()
+            culled_layer = culling.CulledLayer(sprite_list)
+            self.culled_layers[layer_name] = culled_layer
+        return culled_layer
+
+    def sync_with_simulation(self):
+        """ Pass along the sounds and background color the simulation changed. """
+
+        self.audio.play_events(self.sim.sound_events)
+        self.sim.sound_events.clear()
+
+        if self.sim.background_color and self.sim.background_color != self.background_color:
+            self.background_color = self.sim.background_color
+            arcade.set_background_color(self.background_color)
 
-        self.coin_list = None
-        self.wall_list = None
-        self.foreground_list = None
-        self.background_list = None
-        self.dont_touch_list = None
-        self.player_list = None
-        self.player_sprite = None
+    def on_draw(self):
+        """ Render the screen, blended between the last two physics steps. """
 
-        self.physics_engine = None
+        arcade.start_render()
 
-        self.left_pressed = False
-        self.right_pressed = False
-        self.up_pressed = False
-        self.down_pressed = False
+        if not self.level_loaded:
+            self.hud.set_text("loading", "Loading...")
+            self.hud.draw()
+            if not self.first_frame_drawn:
+                self.first_frame_drawn = True
+                startup.timeline.mark("first frame")
+            return
 
-        self.view_bottom = 0
-        self.view_left = 0
+        sim = self.sim
+        player_x, player_y, view_left, view_bottom = sim.interpolated_state(sim.clock.alpha)
 
-        self.score = 0
+        viewport = (view_left, view_bottom)
+        if viewport != self.viewport:
+            self.viewport = viewport
+            arcade.set_viewport(view_left,
+                                SCREEN_WIDTH + view_left,
+                                view_bottom,
+                                SCREEN_HEIGHT + view_bottom)
 
-        self.end_of_map = 0
+        # Only the player moves, so it is the only sprite that needs blending
+        step_position = sim.player_sprite.position
+        sim.player_sprite.position = (player_x, player_y)
 
-        self.level = 1
+        self.compositor.draw()
 
-        self.collect_coin_sound = arcade.load_sound("sounds/coin1.wav")
-        self.jump_sound = arcade.load_sound("sounds/jump1.wav")
-        self.game_over = arcade.load_sound("sounds/gameover1.wav")
+        sim.player_sprite.position = step_position
 
-    def setup(self, level):
-        """ Set up the game here. Call this function to restart the game. """
+        frame_profiler = sim.profiler
+        start_time = frame_profiler.start()
+        self.hud.set_text("score", f"Score: {sim.score}")
+        self.hud.draw()
+        frame_profiler.stop("draw hud", start_time)
 
-        self.view_bottom = 0
-        self.view_left = 0
-
-        self.score = 0
-
-        self.player_list = arcade.SpriteList()
-        self.foreground_list = arcade.SpriteList()
-        self.background_list = arcade.SpriteList()
-        self.wall_list = arcade.SpriteList()
-        self.coin_list = arcade.SpriteList()
-
-        image_source = "images/player_1/female_stand.png"
-        self.player_sprite = arcade.Sprite(image_source, CHARACTER_SCALING)
-
-        self.player_sprite.center_x = PLAYER_START_X
-        self.player_sprite.center_y = PLAYER_START_Y
-
-        self.player_list.append(self.player_sprite)
-
-        # ---------------------- Load in a map from the tiled editor ----------------------
-        platforms_layer_name = 'Platforms'
-        coins_layer_name = 'Coins'
-        foreground_layer_name = 'Foreground'
-        background_layer_name = 'Background'
-        dont_touch_layer_name = "Don't Touch"
-
-        map_name = f"tmx_map/funhouse_level_{level}.tmx"
-        my_map = arcade.tilemap.read_tmx(map_name)
-        self.end_of_map = my_map.map_size.width * GRID_PIXEL_SIZE
-
-        # ---------------------- Background ----------------------
-        self.background_list = arcade.tilemap.process_layer(my_map,
-                                                            background_layer_name,
-                                                            TILE_SCALING)
-        # ---------------------- Foreground ----------------------
-        self.foreground_list = arcade.tilemap.process_layer(my_map,
-                                                            foreground_layer_name,
-                                                            TILE_SCALING)
-        # ---------------------- Platforms ----------------------
-        self.wall_list = arcade.tilemap.process_layer(my_map,
-                                                      platforms_layer_name,
-                                                      TILE_SCALING,
-                                                      use_spatial_hash=True)
-        # ---------------------- Coins ----------------------
-        self.coin_list = arcade.tilemap.process_layer(my_map,
-                                                      coins_layer_name,
-                                                      TILE_SCALING,
-                                                      use_spatial_hash=True)
-        # ---------------------- Don't Touch Layer ----------------------
-        self.dont_touch_list = arcade.tilemap.process_layer(my_map,
-                                                            dont_touch_layer_name,
-                                                            TILE_SCALING,
-                                                            use_spatial_hash=True)
-        # ---------------------- Other stuff ----------------------
-        if my_map.background_color:
-            arcade.set_background_color(my_map.background_color)
-        self.physics_engine = arcade.PhysicsEnginePlatformer(self.player_sprite,
-                                                             self.wall_list,
-                                                             GRAVITY)
+        frame_profiler.end_frame()
 
-    def on_draw(self):
-        """ Render the screen. """
+        if not self.startup_reported:
+            self.startup_reported = True
+            self.report_startup()
 
-        arcade.start_render()
+    def show_profile_overlay(self, lines):
+        """ Put the per-phase timings in the top left corner of the HUD. """
 
-        self.wall_list.draw()
-        self.background_list.draw()
-        self.wall_list.draw()
-        self.coin_list.draw()
-        self.dont_touch_list.draw()
-        self.player_list.draw()
-        self.foreground_list.draw()
+        for line_number in range(self.profile_line_count, len(lines)):
+            self.hud.add_text(f"profile {line_number}", 10, SCREEN_HEIGHT - 20 - line_number * 14,
+                              arcade.csscolor.BLACK, 10)
+        self.profile_line_count = max(self.profile_line_count, len(lines))
 
-        score_text = f"Score: {self.score}"
-        arcade.draw_text(score_text, 10 + self.view_left, 10 + self.view_bottom,
-                         arcade.csscolor.BLACK, 18)
+        for line_number in range(self.profile_line_count):
+            line = lines[line_number] if line_number < len(lines) else ""
+            self.hud.set_text(f"profile {line_number}", line)
 
     def on_key_press(self, key, modifiers):
         """Called whenever a key is pressed. """
 
-        if key == arcade.key.UP or key == arcade.key.W or key == arcade.key.SPACE:
-            self.up_pressed = True
+        if key == arcade.key.F3:
+            self.sim.profiler.toggle()
+            self.profile_refresh_timer = 0
+            if not self.sim.profiler.enabled:
+                self.show_profile_overlay([])
+        elif key == arcade.key.UP or key == arcade.key.W or key == arcade.key.SPACE:
+            self.sim.up_pressed = True
         elif key == arcade.key.LEFT or key == arcade.key.A:
-            self.left_pressed = True
+            self.sim.left_pressed = True
         elif key == arcade.key.RIGHT or key == arcade.key.D:
-            self.right_pressed = True
+            self.sim.right_pressed = True
 
     def on_key_release(self, key, modifiers):
         """Called when the user releases a key. """
 
         if key == arcade.key.UP or key == arcade.key.W:
-            self.up_pressed = False
+            self.sim.up_pressed = False
         elif key == arcade.key.LEFT or key == arcade.key.A:
-            self.left_pressed = False
+            self.sim.left_pressed = False
         elif key == arcade.key.RIGHT or key == arcade.key.D:
-            self.right_pressed = False
+            self.sim.right_pressed = False
 
     def update(self, delta_time):
-        """ Movement and game logic """
-
-        self.player_sprite.change_x = 0
-
-        if self.up_pressed and not self.down_pressed:
-            if self.physics_engine.can_jump():
-                self.player_sprite.change_y = PLAYER_JUMP_SPEED
-                arcade.play_sound(self.jump_sound)
-
-        if self.left_pressed and not self.right_pressed:
-            self.player_sprite.change_x = -PLAYER_MOVEMENT_SPEED
-        elif self.right_pressed and not self.left_pressed:
-            self.player_sprite.change_x = PLAYER_MOVEMENT_SPEED
-
-        self.player_list.update()
+        """ Advance the simulation by however long the last frame took. """
 
-        self.physics_engine.update()
+        if not self.level_loaded:
+            if self.sim.level_pipeline.ready(self.sim.level):
+                self.finish_loading()
+            return
 
-        coin_hit_list = arcade.check_for_collision_with_list(self.player_sprite,
-                                                             self.coin_list)
+        self.sim.update(delta_time)
+        self.sync_with_simulation()
 
-        for coin in coin_hit_list:
-            coin.remove_from_sprite_lists()
-            arcade.play_sound(self.collect_coin_sound)
-            self.score += 1
-
-        changed_viewport = False
-
-        if self.player_sprite.center_y < -100:
-            self.player_sprite.center_x = PLAYER_START_X
-            self.player_sprite.center_y = PLAYER_START_Y
-
-            self.view_left = 0
-            self.view_bottom = 0
-            changed_viewport = True
-            arcade.play_sound(self.game_over)
-
-        if arcade.check_for_collision_with_list(self.player_sprite,
-                                                self.dont_touch_list):
-            self.player_sprite.change_x = 0
-            self.player_sprite.change_y = 0
-            self.player_sprite.center_x = PLAYER_START_X
-            self.player_sprite.center_y = PLAYER_START_Y
-
-            self.view_left = 0
-            self.view_bottom = 0
-            changed_viewport = True
-            arcade.play_sound(self.game_over)
-
-        if self.player_sprite.center_x >= self.end_of_map:
-            self.level += 1
-
-            self.setup(self.level)
-
-            self.view_left = 0
-            self.view_bottom = 0
-            changed_viewport = True
-
-        # ---------------------- Manage Scrolling ----------------------
-        # Scroll left
-        left_boundary = self.view_left + LEFT_VIEWPORT_MARGIN
-        if self.player_sprite.left < left_boundary:
-            self.view_left -= left_boundary - self.player_sprite.left
-            changed_viewport = True
-
-        # Scroll right
-        right_boundary = self.view_left + SCREEN_WIDTH - RIGHT_VIEWPORT_MARGIN
-        if self.player_sprite.right > right_boundary:
-            self.view_left += self.player_sprite.right - right_boundary
-            changed_viewport = True
-
-        # Scroll up
-        top_boundary = self.view_bottom + SCREEN_HEIGHT - TOP_VIEWPORT_MARGIN
-        if self.player_sprite.top > top_boundary:
-            self.view_bottom += self.player_sprite.top - top_boundary
-            changed_viewport = True
-
-        # Scroll down
-        bottom_boundary = self.view_bottom + BOTTOM_VIEWPORT_MARGIN
-        if self.player_sprite.bottom < bottom_boundary:
-            self.view_bottom -= bottom_boundary - self.player_sprite.bottom
-            changed_viewport = True
-
-        if changed_viewport:
-            self.view_bottom = int(self.view_bottom)
-            self.view_left = int(self.view_left)
-
-            arcade.set_viewport(self.view_left,
-                                SCREEN_WIDTH + self.view_left,
-                                self.view_bottom,
-                                SCREEN_HEIGHT + self.view_bottom)
+        if self.sim.profiler.enabled:
+            self.profile_refresh_timer -= delta_time
+            if self.profile_refresh_timer <= 0:
+                self.profile_refresh_timer = PROFILE_OVERLAY_REFRESH
+                profile_lines = self.sim.profiler.report()
+                profile_lines.append(self.compositor.report())
+                profile_lines.append(self.audio.report())
+                profile_lines.append(texture_cache.cache.report())
+                profile_lines.append(sprite_pool.pool.report())
+                self.show_profile_overlay(profile_lines)
 
 
 def main():
     """ Main method """
-    window = MyGame()
-    window.setup(window.level)
+    parser = argparse.ArgumentParser(description=SCREEN_TITLE)
+    parser.add_argument("--record", metavar="FILE",
+                        help="record keyboard input to a replay file")
+    parser.add_argument("--profile-log", metavar="FILE",
+                        help="profile every frame and log the phase times as JSON lines")
+    parser.add_argument("--startup-log", metavar="FILE",
+                        help="save the startup timeline as JSON")
+    parser.add_argument("--stream", action="store_true",
+                        help="load levels in chunks around the viewport, for very wide maps")
+    args = parser.parse_args()
+
+    window = MyGame(stream_level=args.stream)
+    window.startup_log = args.startup_log
+    if args.record:
+        window.sim.input_recorder = replay.InputRecorder(open(args.record, "wb"),
+                                                         window.sim.level,
+                                                         window.sim.clock.step_time)
+    if args.profile_log:
+        window.sim.profiler.open_log(args.profile_log)
+        window.sim.profiler.toggle()
     arcade.run()
 
+    window.sim.profiler.close_log()
+    window.audio.delete()
+
+    if window.sim.input_recorder is not None:
+        window.sim.input_recorder.close()
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
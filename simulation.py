@@ -0,0 +1,396 @@
+"""
+Game logic for the platformer, without a window
+
+GameSimulation owns the sprite lists, the physics engine, the score and
+the viewport position, and steps them forward in update(). It never opens
+a window or makes an OpenGL call, so it runs on machines with no display.
+round1.py draws it and plays its sounds.
+
+Run a headless soak test with:
+
+    python simulation.py 10000
+    python simulation.py 10000 grid    # with the tile-grid collision backend
+    python simulation.py 10000 sprites stream    # streaming the level in chunks
+"""
+import sys
+import time
+
+# Before arcade, so this runs on machines with no display
+import headless
+
+import arcade
+
+import collectibles
+import grid_collision
+import level_pipeline
+import profiler
+import sprite_pool
+import texture_cache
+import timestep
+
+SCREEN_WIDTH = 1000
+SCREEN_HEIGHT = 650
+
+CHARACTER_SCALING = 1
+TILE_SCALING = 0.5
+COIN_SCALING = 0.5
+SPRITE_PIXEL_SIZE = 128
+GRID_PIXEL_SIZE = (SPRITE_PIXEL_SIZE * TILE_SCALING)
+
+# Speeds are per step at BASE_PHYSICS_RATE. Other rates scale them to match.
+PLAYER_MOVEMENT_SPEED = 3
+PLAYER_JUMP_SPEED = 13
+GRAVITY = 0.8
+
+BASE_PHYSICS_RATE = 60
+PHYSICS_RATE = 60
+
+LEFT_VIEWPORT_MARGIN = 200
+RIGHT_VIEWPORT_MARGIN = 200
+BOTTOM_VIEWPORT_MARGIN = 150
+TOP_VIEWPORT_MARGIN = 100
+
+PLAYER_START_X = 64
+PLAYER_START_Y = 225
+
+JUMP_SOUND = "jump"
+COIN_SOUND = "coin"
+GAME_OVER_SOUND = "game_over"
+
+# Collide with the platform and hazard sprites' hit boxes, like arcade does...
+SPRITE_COLLISION = "sprites"
+# ...or with their cells in a grid, treating every tile as a full square. Much faster.
+GRID_COLLISION = "grid"
+
+
+class GameSimulation:
+    """
+    All of the game state, and the rules that move it forward.
+    """
+
+    def __init__(self, physics_rate=PHYSICS_RATE, bake_static_layers=False,
+                 collision_backend=SPRITE_COLLISION, stream_level=False):
+
+        self.clock = timestep.FixedTimestep(physics_rate)
+
+        step_scale = BASE_PHYSICS_RATE / physics_rate
+        self.movement_speed = PLAYER_MOVEMENT_SPEED * step_scale
+        self.jump_speed = PLAYER_JUMP_SPEED * step_scale
+        self.gravity = GRAVITY * step_scale * step_scale
+
+        self.coins = None
+        self.wall_list = None
+        self.dont_touch_list = None
+        self.player_list = None
+        self.player_sprite = None
+
+        self.physics_engine = None
+
+        self.collision_backend = collision_backend
+        # The Don't Touch layer as a grid_collision.TileGrid, with GRID_COLLISION
+        self.hazard_grid = None
+
+        self.left_pressed = False
+        self.right_pressed = False
+        self.up_pressed = False
+        self.down_pressed = False
+
+        self.view_bottom = 0
+        self.view_left = 0
+
+        # Where the player and viewport were before the last step, for drawing in between steps
+        self.previous_player_position = (0, 0)
+        self.previous_view = (0, 0)
+
+        self.score = 0
+
+        self.end_of_map = 0
+
+        self.level = 1
+
+        # The level_pipeline.LoadedLevel being played
+        self.loaded_level = None
+
+        self.background_color = None
+
+        # Pre-rendered copies of the static layers, if the pipeline was asked
+        # to make them. Only a renderer has any use for these.
+        self.baked_layers = {}
+
+        # Names of the sounds triggered since the renderer last emptied this
+        self.sound_events = []
+
+        # Set to a replay.InputRecorder to log the input of every tick
+        self.input_recorder = None
+
+        # Off until something turns it on, see profiler.py
+        self.profiler = profiler.FrameProfiler()
+
+        self.level_pipeline = level_pipeline.LevelPipeline(TILE_SCALING, bake_static_layers,
+                                                           stream_level)
+
+    def setup(self, level):
+        """ Set up the game here. Call this function to restart the game. """
+
+        self.view_bottom = 0
+        self.view_left = 0
+
+        self.score = 0
+
+        if self.player_list is not None:
+            sprite_pool.pool.recycle_list(self.player_list, "player")
+        self.player_list = sprite_pool.pool.sprite_list("player")
+
+        image_source = "images/player_1/female_stand.png"
+        self.player_sprite = texture_cache.make_sprite(image_source, CHARACTER_SCALING)
+
+        self.player_sprite.center_x = PLAYER_START_X
+        self.player_sprite.center_y = PLAYER_START_Y
+
+        self.player_list.append(self.player_sprite)
+
+        # ---------------------- Load in a map from the tiled editor ----------------------
+        # Usually the pipeline has already built this level in the background
+        loaded_level = self.level_pipeline.take(level)
+
+        # Give back the old level before the next one starts building, so it
+        # can reuse the sprites. The textures it shares with this level stay cached.
+        if self.coins is not None:
+            self.coins.release()
+        if self.loaded_level is not None:
+            self.loaded_level.release()
+        self.level_pipeline.prefetch(level + 1)
+
+        self.loaded_level = loaded_level
+        self.end_of_map = loaded_level.end_of_map
+
+        if loaded_level.streaming_level is not None:
+            loaded_level.stream(self.view_left, SCREEN_WIDTH)
+        self.wall_list = loaded_level.wall_list
+        self.coins = self.collectible_layer()
+        self.dont_touch_list = loaded_level.dont_touch_list
+        self.baked_layers = loaded_level.baked_layers
+
+        # ---------------------- Other stuff ----------------------
+        self.background_color = loaded_level.background_color
+        if self.collision_backend == GRID_COLLISION:
+            platform_grid = loaded_level.tile_grid(level_pipeline.PLATFORMS_LAYER_NAME)
+            self.hazard_grid = loaded_level.tile_grid(level_pipeline.DONT_TOUCH_LAYER_NAME)
+            self.physics_engine = grid_collision.GridPhysicsEngine(self.player_sprite,
+                                                                   platform_grid,
+                                                                   self.gravity)
+        else:
+            self.physics_engine = arcade.PhysicsEnginePlatformer(self.player_sprite,
+                                                                 self.wall_list,
+                                                                 self.gravity)
+        self.snap_interpolation()
+
+    def use_loaded_lists(self):
+        """ Catch up with the sprite lists a streamed level just changed. """
+        loaded_level = self.loaded_level
+        self.wall_list = loaded_level.wall_list
+        self.dont_touch_list = loaded_level.dont_touch_list
+        self.coins.release()
+        self.coins = self.collectible_layer()
+        if self.collision_backend != GRID_COLLISION:
+            self.physics_engine.platforms = self.wall_list
+
+    def collectible_layer(self):
+        """ The loaded level's coins, which it swaps for the compacted list when they compact. """
+        loaded_level = self.loaded_level
+        return collectibles.CollectibleLayer(
+            loaded_level.coin_list,
+            level_pipeline.COINS_LAYER_NAME,
+            lambda sprite_list: loaded_level.replace_sprite_list(level_pipeline.COINS_LAYER_NAME,
+                                                                 sprite_list))
+
+    @property
+    def coin_list(self):
+        """ The coins, collected ones included until the layer next compacts. """
+        return self.coins.sprite_list if self.coins is not None else None
+
+    @property
+    def background_list(self):
+        """ Only drawn, never simulated, so it isn't built until it's asked for. """
+        return self.loaded_level.background_list if self.loaded_level is not None else None
+
+    @property
+    def foreground_list(self):
+        """ Only drawn, never simulated, so it isn't built until it's asked for. """
+        return self.loaded_level.foreground_list if self.loaded_level is not None else None
+
+    def update(self, delta_time):
+        """ Run however many fixed steps fit into delta_time. """
+
+        for _ in range(self.clock.advance(delta_time)):
+            self.step()
+
+    def snap_interpolation(self):
+        """ Make the last step's start match the current state, after a teleport. """
+        self.previous_player_position = (self.player_sprite.center_x, self.player_sprite.center_y)
+        self.previous_view = (self.view_left, self.view_bottom)
+
+    def interpolated_state(self, alpha):
+        """ The player position and viewport to draw, alpha of the way into the next step. """
+        previous_x, previous_y = self.previous_player_position
+        previous_left, previous_bottom = self.previous_view
+        player_x = previous_x + (self.player_sprite.center_x - previous_x) * alpha
+        player_y = previous_y + (self.player_sprite.center_y - previous_y) * alpha
+        view_left = int(previous_left + (self.view_left - previous_left) * alpha)
+        view_bottom = int(previous_bottom + (self.view_bottom - previous_bottom) * alpha)
+        return player_x, player_y, view_left, view_bottom
+
+    def step(self):
+        """ Movement and game logic, for one fixed step """
+
+        self.snap_interpolation()
+
+        if self.input_recorder is not None:
+            self.input_recorder.record(self)
+
+        frame_profiler = self.profiler
+        start_time = frame_profiler.start()
+
+        self.player_sprite.change_x = 0
+
+        if self.up_pressed and not self.down_pressed:
+            if self.physics_engine.can_jump():
+                self.player_sprite.change_y = self.jump_speed
+                self.sound_events.append(JUMP_SOUND)
+
+        if self.left_pressed and not self.right_pressed:
+            self.player_sprite.change_x = -self.movement_speed
+        elif self.right_pressed and not self.left_pressed:
+            self.player_sprite.change_x = self.movement_speed
+
+        frame_profiler.stop("input", start_time)
+
+        start_time = frame_profiler.start()
+        self.player_list.update()
+        frame_profiler.stop("player_list.update", start_time)
+
+        start_time = frame_profiler.start()
+        self.physics_engine.update()
+        frame_profiler.stop("physics_engine.update", start_time)
+
+        start_time = frame_profiler.start()
+        coin_hit_list = self.coins.collisions(self.player_sprite)
+
+        streaming_level = self.loaded_level.streaming_level
+        for coin in coin_hit_list:
+            self.coins.collect(coin)
+            if streaming_level is not None:
+                streaming_level.remove(level_pipeline.COINS_LAYER_NAME, coin)
+            self.sound_events.append(COIN_SOUND)
+            self.score += 1
+
+        self.coins.compact_if_needed()
+
+        frame_profiler.stop("coin collision", start_time)
+
+        changed_viewport = False
+
+        if self.player_sprite.center_y < -100:
+            self.player_sprite.center_x = PLAYER_START_X
+            self.player_sprite.center_y = PLAYER_START_Y
+
+            self.view_left = 0
+            self.view_bottom = 0
+            changed_viewport = True
+            self.snap_interpolation()
+            self.sound_events.append(GAME_OVER_SOUND)
+
+        start_time = frame_profiler.start()
+        if self.hazard_grid is not None:
+            touched_hazard = self.hazard_grid.overlaps_sprite(self.player_sprite)
+        else:
+            touched_hazard = arcade.check_for_collision_with_list(self.player_sprite,
+                                                                  self.dont_touch_list)
+        frame_profiler.stop("don't touch collision", start_time)
+
+        if touched_hazard:
+            self.player_sprite.change_x = 0
+            self.player_sprite.change_y = 0
+            self.player_sprite.center_x = PLAYER_START_X
+            self.player_sprite.center_y = PLAYER_START_Y
+
+            self.view_left = 0
+            self.view_bottom = 0
+            changed_viewport = True
+            self.snap_interpolation()
+            self.sound_events.append(GAME_OVER_SOUND)
+
+        if self.player_sprite.center_x >= self.end_of_map:
+            self.level += 1
+
+            self.setup(self.level)
+
+            self.view_left = 0
+            self.view_bottom = 0
+            changed_viewport = True
+            self.snap_interpolation()
+
+        # ---------------------- Manage Scrolling ----------------------
+        start_time = frame_profiler.start()
+
+        # Scroll left
+        left_boundary = self.view_left + LEFT_VIEWPORT_MARGIN
+        if self.player_sprite.left < left_boundary:
+            self.view_left -= left_boundary - self.player_sprite.left
+            changed_viewport = True
+
+        # Scroll right
+        right_boundary = self.view_left + SCREEN_WIDTH - RIGHT_VIEWPORT_MARGIN
+        if self.player_sprite.right > right_boundary:
+            self.view_left += self.player_sprite.right - right_boundary
+            changed_viewport = True
+
+        # Scroll up
+        top_boundary = self.view_bottom + SCREEN_HEIGHT - TOP_VIEWPORT_MARGIN
+        if self.player_sprite.top > top_boundary:
+            self.view_bottom += self.player_sprite.top - top_boundary
+            changed_viewport = True
+
+        # Scroll down
+        bottom_boundary = self.view_bottom + BOTTOM_VIEWPORT_MARGIN
+        if self.player_sprite.bottom < bottom_boundary:
+            self.view_bottom -= bottom_boundary - self.player_sprite.bottom
+            changed_viewport = True
+
+        if changed_viewport:
+            self.view_bottom = int(self.view_bottom)
+            self.view_left = int(self.view_left)
+
+        frame_profiler.stop("scrolling", start_time)
+
+        if self.loaded_level.streaming_level is not None:
+            start_time = frame_profiler.start()
+            if self.loaded_level.stream(self.view_left, SCREEN_WIDTH):
+                self.use_loaded_lists()
+            frame_profiler.stop("streaming", start_time)
+
+
+def main():
+    """ Run the game with no window, holding right and jumping, as fast as it goes. """
+    ticks = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    collision_backend = sys.argv[2] if len(sys.argv) > 2 else SPRITE_COLLISION
+    stream_level = len(sys.argv) > 3 and sys.argv[3] == "stream"
+
+    sim = GameSimulation(collision_backend=collision_backend, stream_level=stream_level)
+    sim.setup(sim.level)
+    sim.right_pressed = True
+
+    start_time = time.perf_counter()
+    for tick in range(ticks):
+        sim.up_pressed = tick % 60 < 10
+        sim.step()
+        sim.sound_events.clear()
+    elapsed = time.perf_counter() - start_time
+
+    print(f"{ticks} ticks in {elapsed:.2f}s ({ticks / elapsed:.0f} ticks/s), "
+          f"level {sim.level}, score {sim.score}, {collision_backend} collision"
+          + (", streamed" if stream_level else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Sprite pooling
+
+Each level makes a sprite per tile and a sprite list per layer, and when
+the next level replaces it they all become garbage at once, which the
+collector then stops the game to clean up. A SpritePool takes a finished
+level's sprites and lists back instead, and hands them out again for the
+next one.
+
+A sprite is only taken back once it isn't in any other list, so a sprite
+something else still holds, like a renderer's culled selection, is left
+alone. Lists are kept per layer name. A reused list whose sprites only
+use textures it has seen before keeps its sprite sheet, since arcade only
+rebuilds that when a new texture turns up.
+"""
+import collections
+import threading
+
+import arcade
+
+# Most spare sprites kept, and most spare lists kept per layer
+MAX_FREE_SPRITES = 20000
+MAX_FREE_LISTS = 4
+
+
+def clear_list(sprite_list):
+    """
+    Empty a sprite list in place and return the sprites it had. Unlike a
+    new list, it keeps its sprite sheet for the textures it has seen.
+    """
+    sprites = sprite_list.sprite_list
+    for sprite in sprites:
+        sprite.sprite_lists.remove(sprite_list)
+    sprite_list.sprite_list = []
+    sprite_list.sprite_idx = {}
+    if sprite_list.spatial_hash is not None:
+        sprite_list.spatial_hash.reset()
+    return sprites
+
+
+def remove_sprites(sprite_list, should_remove):
+    """
+    Take the sprites should_remove() picks out of a sprite list, in one
+    pass, and return them. SpriteList.remove() reindexes the whole list for
+    every sprite. Like clear_list(), the list keeps its sprite sheet.
+    """
+    kept = []
+    removed = []
+    for sprite in sprite_list.sprite_list:
+        if should_remove(sprite):
+            removed.append(sprite)
+        else:
+            kept.append(sprite)
+    if not removed:
+        return removed
+
+    for sprite in removed:
+        sprite.sprite_lists.remove(sprite_list)
+        if sprite_list.spatial_hash is not None:
+            sprite_list.spatial_hash.remove_object(sprite)
+    sprite_list.sprite_list = kept
+    sprite_list.sprite_idx = {sprite: index for index, sprite in enumerate(kept)}
+    # As SpriteList.remove() does, so the buffers are rebuilt on the next draw
+    sprite_list._vao1 = None
+    return removed
+
+
+class SpritePool:
+    """ Spare sprites and sprite lists. Safe to use from the level loading threads. """
+
+    def __init__(self, max_free_sprites=MAX_FREE_SPRITES, max_free_lists=MAX_FREE_LISTS):
+        self.max_free_sprites = max_free_sprites
+        self.max_free_lists = max_free_lists
+
+        self.free_sprites = []
+        # (layer name, spatial hashed) -> spare empty lists
+        self.free_lists = collections.defaultdict(list)
+        self.lock = threading.Lock()
+
+        self.sprite_hits = 0
+        self.sprite_misses = 0
+        self.list_hits = 0
+        self.list_misses = 0
+        # Sprites given back that were still in another list
+        self.skipped_count = 0
+
+    def sprite(self, texture, scale=1):
+        """ A sprite showing a texture, reused if there's a spare one. """
+        with self.lock:
+            if self.free_sprites:
+                sprite = self.free_sprites.pop()
+                self.sprite_hits += 1
+            else:
+                sprite = None
+                self.sprite_misses += 1
+
+        if sprite is None:
+            sprite = arcade.Sprite(scale=scale)
+        else:
+            # Back to how a new sprite starts out
+            sprite.set_hit_box(None)
+            sprite.scale = scale
+            sprite.angle = 0
+            sprite.color = (255, 255, 255)
+            sprite.alpha = 255
+            # Worked out from the size on the first collision check, so it has
+            # to go before the new texture sets a different size
+            sprite._collision_radius = None
+            sprite.change_x = 0
+            sprite.change_y = 0
+            sprite.change_angle = 0
+            sprite.properties = {}
+
+        sprite.textures = [texture]
+        sprite.texture = texture
+        return sprite
+
+    def sprite_list(self, name=None, use_spatial_hash=None):
+        """ An empty sprite list for a layer, reused if there's a spare one. """
+        key = (name, use_spatial_hash is True)
+        with self.lock:
+            free_lists = self.free_lists[key]
+            if free_lists:
+                self.list_hits += 1
+                return free_lists.pop()
+            self.list_misses += 1
+        return arcade.SpriteList(use_spatial_hash=use_spatial_hash)
+
+    def recycle_sprites(self, sprites):
+        """ Take back sprites that are done with. Ones still in a list are skipped. """
+        with self.lock:
+            for sprite in sprites:
+                if sprite.sprite_lists:
+                    self.skipped_count += 1
+                elif len(self.free_sprites) < self.max_free_sprites:
+                    self.free_sprites.append(sprite)
+
+    def recycle_list(self, sprite_list, name=None):
+        """
+        Take back a sprite list and, if nothing else has them, its sprites.
+        Nothing may use the list after this.
+        """
+        self.recycle_sprites(clear_list(sprite_list))
+
+        key = (name, sprite_list.spatial_hash is not None)
+        with self.lock:
+            if len(self.free_lists[key]) < self.max_free_lists:
+                self.free_lists[key].append(sprite_list)
+
+    def report(self):
+        """ One line of pool statistics, for the profiler overlay. """
+        with self.lock:
+            free_list_count = sum(len(free_lists) for free_lists in self.free_lists.values())
+            return (f"sprite pool: sprites {self.sprite_hits} reused/{self.sprite_misses} new, "
+                    f"lists {self.list_hits} reused/{self.list_misses} new, "
+                    f"{len(self.free_sprites)} sprites and {free_list_count} lists spare, "
+                    f"{self.skipped_count} still in use")
+
+
+# The pool every level shares
+pool = SpritePool()
@@ -0,0 +1,61 @@
+"""
+Startup timeline
+
+Records when each part of starting the game began and ended, timed from
+the moment this module was first imported, so the time to the first frame
+can be broken down. round1.py imports it before anything heavy. Spans can
+come from any thread, they all use the same perf_counter() clock.
+"""
+import json
+import time
+
+# perf_counter() when the game started, near enough
+PROCESS_START = time.perf_counter()
+
+
+class StartupTimeline:
+    """ Named spans of time since startup. """
+
+    def __init__(self, origin=PROCESS_START):
+        self.origin = origin
+
+        # (name, start, end), in perf_counter() seconds
+        self.spans = []
+
+    def start(self):
+        """ Mark the start of a span. Pass the result to stop(). """
+        return time.perf_counter()
+
+    def stop(self, name, start_time):
+        """ Record a span from start() until now. """
+        self.spans.append((name, start_time, time.perf_counter()))
+
+    def add(self, name, start_time, end_time):
+        """ Record a span timed somewhere else, like on the level loading thread. """
+        self.spans.append((name, start_time, end_time))
+
+    def mark(self, name):
+        """ Record a moment, like the first frame. """
+        now = time.perf_counter()
+        self.spans.append((name, now, now))
+
+    def report(self):
+        """ One line per span, in the order they started: when it started, and how long it took. """
+        lines = [f"{'start':>10}{'took':>10}  ms"]
+        for name, start_time, end_time in sorted(self.spans, key=lambda span: span[1]):
+            lines.append(f"{(start_time - self.origin) * 1000:>10.1f}"
+                         f"{(end_time - start_time) * 1000:>10.1f}  {name}")
+        return lines
+
+    def write(self, file_name):
+        """ Save the spans as JSON, times in milliseconds since startup. """
+        records = [{"name": name,
+                    "start": round((start_time - self.origin) * 1000, 3),
+                    "duration": round((end_time - start_time) * 1000, 3)}
+                   for name, start_time, end_time in sorted(self.spans, key=lambda span: span[1])]
+        with open(file_name, "w") as timeline_file:
+            json.dump(records, timeline_file, indent=1)
+
+
+# The game's timeline
+timeline = StartupTimeline()
@@ -0,0 +1,167 @@
+"""
+Streaming levels
+
+A level normally has every tile of every layer built into sprites when it
+loads, so the memory and load time of a level grow with its length. A
+StreamingLevel splits the map into chunks of CHUNK_COLUMNS columns and only
+keeps sprites for the chunks around the viewport. As the viewport moves,
+chunks coming into range are built and chunks left far behind are dropped.
+
+Each layer is still one sprite list, so the physics engine, collision
+checks and drawing use it as they would a whole level's list. The lists
+come from the sprite_pool and are kept for the whole level: a chunk that
+loads has its sprites added, and a chunk that drops has its sprites
+taken out, so nothing else is re-hashed and the lists keep their sprite
+sheets. Sprites are drawn in the order their chunks loaded.
+"""
+import math
+
+import level_cache
+import sprite_pool
+
+# Width of one chunk, in tiles
+CHUNK_COLUMNS = 32
+
+# Chunks kept loaded past the right and left edges of the viewport
+LOAD_AHEAD_CHUNKS = 1
+KEEP_BEHIND_CHUNKS = 1
+
+
+class StreamingLevel:
+    """ The layers of a level_cache.CompiledLevel, built a chunk at a time. """
+
+    def __init__(self, level, layers, scaling=1, chunk_columns=CHUNK_COLUMNS,
+                 load_ahead=LOAD_AHEAD_CHUNKS, keep_behind=KEEP_BEHIND_CHUNKS, owner=None):
+        self.level = level
+        # Holds the textures of the sprites built, in texture_cache
+        self.owner = owner
+        self.scaling = scaling
+        self.chunk_columns = chunk_columns
+        self.load_ahead = load_ahead
+        self.keep_behind = keep_behind
+
+        # layer name -> use_spatial_hash for its sprite list
+        self.layers = layers
+
+        self.tile_width = level.tile_width * scaling
+        self.tile_height = level.tile_height * scaling
+        self.chunk_width = chunk_columns * self.tile_width
+        self.chunk_count = math.ceil(level.map_width / chunk_columns)
+
+        # chunk number -> {layer name: [sprites]}
+        self.chunks = {}
+
+        # layer name -> SpriteList of every loaded chunk's sprites
+        self.sprite_lists = {layer_name: sprite_pool.pool.sprite_list(layer_name, use_spatial_hash)
+                             for layer_name, use_spatial_hash in layers.items()}
+
+        # (layer name, column, row) of tiles taken out of play, like collected
+        # coins, which stay gone when their chunk is built again
+        self.removed = set()
+
+        # layer name -> sprites taken out of play that are still in its list,
+        # hidden, until the list next changes
+        self.hidden = {layer_name: set() for layer_name in layers}
+
+        self.load_count = 0
+        self.unload_count = 0
+        # Times update() changed the sprite lists
+        self.change_count = 0
+
+    def wanted_chunks(self, view_left, view_width):
+        """ The chunk numbers that should be loaded for a viewport. """
+        first = math.floor(view_left / self.chunk_width) - self.keep_behind
+        last = math.floor((view_left + view_width) / self.chunk_width) + self.load_ahead
+        return range(max(first, 0), min(last, self.chunk_count - 1) + 1)
+
+    def cell(self, sprite):
+        """ The (column, row) of the map a layer sprite was made for. """
+        column = round((sprite.center_x - sprite.width / 2) / self.tile_width)
+        row = self.level.map_height - 1 - round((sprite.center_y - sprite.height / 2)
+                                                / self.tile_height)
+        return column, row
+
+    def remove(self, layer_name, sprite):
+        """ Keep a tile out of its layer from now on, even after its chunk is built again. """
+        column, row = self.cell(sprite)
+        self.removed.add((layer_name, column, row))
+        self.hidden[layer_name].add(sprite)
+        # Its chunk lets go of it too, so once it's out of the sprite list it
+        # can go back to the sprite_pool without the chunk still holding it
+        chunk_sprites = self.chunks.get(column // self.chunk_columns, {}).get(layer_name)
+        if chunk_sprites is not None and sprite in chunk_sprites:
+            chunk_sprites.remove(sprite)
+
+    def chunk_of(self, sprite):
+        """ The chunk number a layer sprite was made for. """
+        return self.cell(sprite)[0] // self.chunk_columns
+
+    def replace_list(self, layer_name, sprite_list):
+        """ Use a new sprite list for a layer, like the coins once they've been compacted. """
+        self.sprite_lists[layer_name] = sprite_list
+        self.hidden[layer_name] = {sprite for sprite in self.hidden[layer_name]
+                                   if sprite_list in sprite.sprite_lists}
+
+    def load_chunk(self, chunk):
+        """ Build the sprites of every layer for one chunk, and add them to the layers' lists. """
+        columns = range(chunk * self.chunk_columns, (chunk + 1) * self.chunk_columns)
+        layers = {}
+        built = level_cache.build_layers(self.level, self.layers, self.scaling, columns,
+                                         owner=self.owner)
+        for layer_name, sprites in built.items():
+            layers[layer_name] = [sprite for sprite in sprites
+                                  if (layer_name,) + self.cell(sprite) not in self.removed]
+            self.sprite_lists[layer_name].extend(layers[layer_name])
+        self.chunks[chunk] = layers
+        self.load_count += 1
+
+    def drop_chunks(self, chunks):
+        """ Take the sprites of some chunks out of the layers' lists, and give them to the pool. """
+        for chunk in chunks:
+            del self.chunks[chunk]
+            self.unload_count += 1
+
+        # Found by position rather than from the chunks, to include collected
+        # pickups that are still in the list, hidden
+        chunks = set(chunks)
+        for sprite_list in self.sprite_lists.values():
+            removed = sprite_pool.remove_sprites(sprite_list,
+                                                 lambda sprite: self.chunk_of(sprite) in chunks)
+            sprite_pool.pool.recycle_sprites(sprite for sprite in removed
+                                             if not sprite.sprite_lists)
+
+    def update(self, view_left, view_width):
+        """
+        Load and drop chunks for the viewport. Returns True if that changed
+        the layers' sprite lists.
+        """
+        wanted = self.wanted_chunks(view_left, view_width)
+        missing = [chunk for chunk in wanted if chunk not in self.chunks]
+
+        # Only drop chunks once they are well out of range, so walking back
+        # and forth over a chunk edge doesn't build the same chunk every time
+        first_kept = wanted.start - self.keep_behind
+        last_kept = wanted.stop - 1 + self.load_ahead
+        stale = [chunk for chunk in self.chunks if not first_kept <= chunk <= last_kept]
+
+        if not missing and not stale:
+            return False
+
+        # The lists are changing anyway, so the hidden tiles go now. The caller
+        # forgets what was collected, and they'd count again otherwise.
+        for layer_name, hidden in self.hidden.items():
+            if hidden:
+                removed = sprite_pool.remove_sprites(self.sprite_lists[layer_name],
+                                                     hidden.__contains__)
+                sprite_pool.pool.recycle_sprites(sprite for sprite in removed
+                                                 if not sprite.sprite_lists)
+                hidden.clear()
+
+        # Dropped first, so their sprites can be reused for the new chunks
+        if stale:
+            self.drop_chunks(stale)
+        for chunk in missing:
+            self.load_chunk(chunk)
+
+        self.change_count += 1
+        return True
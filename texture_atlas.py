@@ -0,0 +1,206 @@
+"""
+Texture atlases
+
+Every tile in a map, and the player, is its own PNG, so loading a level
+opens a file per distinct tile. Running this module packs every image the
+maps use, along with the item, enemy and player images, into a few
+power-of-two atlas pages, and writes an index of where each image went:
+
+    python texture_atlas.py
+
+After that, texture_cache cuts each image's texture out of an atlas page
+instead of opening the original file, and opens each page only once.
+Images that aren't in the index, or all of them if the atlas hasn't been
+built, load from their own files as before. The index records each
+image's size and modification time, and an image whose file has changed
+since it was packed loads from the file too, with a warning. Run it again
+after adding or changing images.
+"""
+import glob
+import json
+import os
+
+import PIL.Image
+
+import level_cache
+
+ATLAS_DIRECTORY = "atlas"
+INDEX_FILE = os.path.join(ATLAS_DIRECTORY, "index.json")
+
+# Largest atlas page, in pixels. Pages are shrunk to the smallest power of two that fits.
+ATLAS_SIZE = 2048
+
+# Empty pixels between images, so filtering never bleeds one into the next
+PADDING = 2
+
+# Packed whether a map uses them or not
+SPRITE_IMAGES = ["images/items/*.png",
+                 "images/enemies/*.png",
+                 "images/player_1/*.png"]
+
+
+def referenced_images(map_names):
+    """ The image files of every tile the maps' tilesets use. """
+    image_files = set()
+    for map_name in map_names:
+        level = level_cache.read_source(map_name)
+        for image_file, _, _ in level.tiles.values():
+            image_files.add(os.path.normpath(image_file))
+    return image_files
+
+
+def _file_stamp(image_file):
+    """ (size, modification time) of a file, to tell if it changed after packing. """
+    stat = os.stat(image_file)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _power_of_two(size):
+    """ The smallest power of two at least as big as size. """
+    power = 1
+    while power < size:
+        power *= 2
+    return power
+
+
+def pack(images, atlas_size=ATLAS_SIZE, padding=PADDING):
+    """
+    Shelf-pack images, tallest first. Takes file name -> PIL image, and
+    returns a list of pages, each a (width, height, {file name: (x, y)}).
+    """
+    pages = []
+    page = None
+    order = sorted(images, key=lambda name: (images[name].height, images[name].width, name),
+                   reverse=True)
+
+    for name in order:
+        width, height = images[name].size
+        if width + padding > atlas_size or height + padding > atlas_size:
+            raise ValueError(f"Image '{name}' is {width}x{height}, "
+                             f"too big for a {atlas_size} pixel atlas.")
+
+        if page is not None and page["x"] + width + padding > atlas_size:
+            # Start a new shelf above the current one
+            page["y"] += page["shelf_height"]
+            page["x"] = 0
+            page["shelf_height"] = 0
+        if page is None or page["y"] + height + padding > atlas_size:
+            page = {"x": 0, "y": 0, "shelf_height": 0, "used_width": 0, "positions": {}}
+            pages.append(page)
+
+        page["positions"][name] = (page["x"], page["y"])
+        page["x"] += width + padding
+        page["used_width"] = max(page["used_width"], page["x"])
+        page["shelf_height"] = max(page["shelf_height"], height + padding)
+
+    return [(_power_of_two(page["used_width"]),
+             _power_of_two(page["y"] + page["shelf_height"]),
+             page["positions"])
+            for page in pages]
+
+
+def build_atlas(map_names, directory=ATLAS_DIRECTORY, atlas_size=ATLAS_SIZE):
+    """ Pack the images, save the pages and write the index. Returns the index. """
+    image_files = referenced_images(map_names)
+    for pattern in SPRITE_IMAGES:
+        image_files.update(os.path.normpath(file_name) for file_name in glob.glob(pattern))
+
+    images = {}
+    missing = []
+    for image_file in sorted(image_files):
+        if not os.path.exists(image_file):
+            missing.append(image_file)
+            continue
+        with PIL.Image.open(image_file) as image:
+            images[image_file] = image.convert("RGBA")
+
+    if missing:
+        print(f"Warning, skipping {len(missing)} missing images, starting with '{missing[0]}'.")
+
+    os.makedirs(directory, exist_ok=True)
+    for old_page in glob.glob(os.path.join(directory, "atlas_*.png")):
+        os.remove(old_page)
+
+    index = {"pages": [], "regions": {}}
+    for page_number, (width, height, positions) in enumerate(pack(images, atlas_size)):
+        page_file = os.path.join(directory, f"atlas_{page_number}.png")
+        page_image = PIL.Image.new("RGBA", (width, height))
+        for image_file, (x, y) in positions.items():
+            image = images[image_file]
+            page_image.paste(image, (x, y))
+            # Pixel rectangle for load_texture(), and the same rectangle as fractions
+            # of the page, top left origin
+            index["regions"][image_file] = {"page": page_number,
+                                            "x": x, "y": y,
+                                            "width": image.width, "height": image.height,
+                                            "stamp": _file_stamp(image_file),
+                                            "uv": [x / width, y / height,
+                                                   (x + image.width) / width,
+                                                   (y + image.height) / height]}
+        page_image.save(page_file)
+        index["pages"].append(page_file.replace(os.sep, "/"))
+
+    with open(os.path.join(directory, "index.json"), "w") as index_file:
+        json.dump(index, index_file, indent=1)
+    return index
+
+
+class TextureAtlas:
+    """ The atlas index: where each packed image is. """
+
+    def __init__(self, index):
+        self.pages = index["pages"]
+        self.regions = index["regions"]
+
+        # Images whose file changed since they were packed
+        self.stale = set()
+
+    def region(self, image_file):
+        """
+        (page file, x, y, width, height) of an image, or None if it wasn't
+        packed or its file has changed since.
+        """
+        image_file = os.path.normpath(image_file)
+        region = self.regions.get(image_file)
+        if region is None or image_file in self.stale:
+            return None
+        try:
+            stamp = _file_stamp(image_file)
+        except FileNotFoundError:
+            stamp = None
+        if region.get("stamp") != stamp:
+            if not self.stale:
+                print(f"Warning, '{image_file}' changed since the atlas was built, and maybe "
+                      "others. They load from their files. Run texture_atlas.py again.")
+            self.stale.add(image_file)
+            return None
+        return (self.pages[region["page"]],
+                region["x"], region["y"], region["width"], region["height"])
+
+
+_atlas = None
+
+
+def get_atlas(index_file=INDEX_FILE):
+    """ The atlas index, read once. None if the atlas hasn't been built. """
+    global _atlas
+    if _atlas is None:
+        try:
+            with open(index_file) as file:
+                _atlas = TextureAtlas(json.load(file))
+        except FileNotFoundError:
+            _atlas = False
+    return _atlas or None
+
+
+def main():
+    """ Build the atlas from every map in tmx_map/ """
+    index = build_atlas(sorted(glob.glob("tmx_map/*.tmx")))
+    print(f"Packed {len(index['regions'])} images into {len(index['pages'])} pages:")
+    for page_file in index["pages"]:
+        with PIL.Image.open(page_file) as page_image:
+            print(f"  {page_file} {page_image.width}x{page_image.height}")
+
+
+if __name__ == "__main__":
+    main()
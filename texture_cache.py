@@ -0,0 +1,188 @@
+"""
+Shared texture cache
+
+Every level uses the same tileset, but arcade.Sprite(filename) decodes
+textures through arcade.load_texture(), whose cache never lets anything go.
+Here textures are made once per process, whatever level asks for them, and
+kept in one cache with a byte budget.
+
+Each level holds a reference to the textures it uses, as their owner, and
+releases them all when it's replaced. Textures nobody owns stay cached,
+so the next level finds them, until the cache goes over its budget: then
+the least recently used of them are dropped. Owned textures are never
+dropped.
+
+Images with a region in the texture atlas are cut out of its page, and
+the pages are cached here too, under the same budget.
+"""
+import collections
+import os
+import threading
+import time
+
+import arcade
+import PIL.Image
+
+import hitbox_cache
+import sprite_pool
+import texture_atlas
+
+# Bytes of decoded image data to keep once nobody owns it
+TEXTURE_BYTE_BUDGET = 64 * 1024 * 1024
+
+BYTES_PER_PIXEL = 4
+
+
+class CachedImage:
+    """ A texture, or an atlas page image, and who's using it. """
+
+    def __init__(self, value, byte_size):
+        self.value = value
+        self.byte_size = byte_size
+        self.owners = set()
+
+
+class TextureCache:
+    """
+    arcade.Textures keyed by resolved image path and flips, shared by
+    everything that asks. Safe to use from the level loading threads.
+    """
+
+    def __init__(self, byte_budget=TEXTURE_BYTE_BUDGET):
+        self.byte_budget = byte_budget
+
+        # key -> CachedImage, least recently used first
+        self.entries = collections.OrderedDict()
+        self.byte_count = 0
+        self.lock = threading.Lock()
+        # Held while an atlas page loads, so threads that all need it decode it once
+        self.page_lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.decode_time = 0.0
+
+    def texture(self, image_file, flipped_horizontally=False, flipped_vertically=False,
+                flipped_diagonally=False, hit_box_algorithm="Simple", owner=None):
+        """
+        The texture for an image, decoded the first time any owner asks for
+        it. The owner, if given, holds on to it until release(owner).
+        """
+        key = (os.path.realpath(image_file), flipped_horizontally, flipped_vertically,
+               flipped_diagonally, hit_box_algorithm)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                if owner is not None:
+                    entry.owners.add(owner)
+                return entry.value
+            self.misses += 1
+
+        # Decoded without the lock, so loading threads don't wait on each other
+        start_time = time.perf_counter()
+        image = self._image(image_file)
+        if flipped_diagonally:
+            image = image.transpose(PIL.Image.TRANSPOSE)
+        if flipped_horizontally:
+            image = image.transpose(PIL.Image.FLIP_LEFT_RIGHT)
+        if flipped_vertically:
+            image = image.transpose(PIL.Image.FLIP_TOP_BOTTOM)
+        name = "-".join(str(part) for part in key)
+        texture = arcade.Texture(name, image, hit_box_algorithm=hit_box_algorithm)
+
+        with self.lock:
+            self.decode_time += time.perf_counter() - start_time
+            # Another thread may have got there first
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = self._add(key, texture, image.width * image.height * BYTES_PER_PIXEL)
+            if owner is not None:
+                entry.owners.add(owner)
+            self._evict()
+            return entry.value
+
+    def _image(self, image_file):
+        """ The RGBA image for a file, cut from its atlas page if it has a region. """
+        atlas = texture_atlas.get_atlas()
+        region = atlas.region(image_file) if atlas is not None else None
+        if region is None:
+            with PIL.Image.open(image_file) as image:
+                return image.convert("RGBA")
+
+        page_file, x, y, width, height = region
+        key = ("page", os.path.realpath(page_file))
+        with self.page_lock:
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is not None:
+                    self.entries.move_to_end(key)
+            if entry is None:
+                with PIL.Image.open(page_file) as image:
+                    page_image = image.convert("RGBA")
+                with self.lock:
+                    entry = self._add(key, page_image,
+                                      page_image.width * page_image.height * BYTES_PER_PIXEL)
+        return entry.value.crop((x, y, x + width, y + height))
+
+    def _add(self, key, value, byte_size):
+        """ Put an entry in. Call with the lock held. """
+        entry = CachedImage(value, byte_size)
+        self.entries[key] = entry
+        self.byte_count += byte_size
+        return entry
+
+    def _evict(self):
+        """ Drop unowned entries, oldest first, until back under budget. Call with the lock held. """
+        if self.byte_count <= self.byte_budget:
+            return
+        for key, entry in list(self.entries.items()):
+            if self.byte_count <= self.byte_budget:
+                break
+            if not entry.owners:
+                del self.entries[key]
+                self.byte_count -= entry.byte_size
+                self.evictions += 1
+
+    def release(self, owner):
+        """ Let go of every texture an owner holds. They stay cached while there's room. """
+        with self.lock:
+            for entry in self.entries.values():
+                entry.owners.discard(owner)
+            self._evict()
+
+    def report(self):
+        """ One line of cache statistics, for the profiler overlay. """
+        with self.lock:
+            owned = sum(1 for entry in self.entries.values() if entry.owners)
+            return (f"textures: {len(self.entries)} cached ({owned} in use), "
+                    f"{self.byte_count / (1024 * 1024):.1f} MB; "
+                    f"{self.hits} hits, {self.misses} misses, {self.evictions} evicted, "
+                    f"{self.decode_time * 1000:.1f} ms decoding")
+
+
+# The cache every level shares
+cache = TextureCache()
+
+
+def make_sprite(image_file, scale=1, flipped_horizontally=False, flipped_vertically=False,
+                flipped_diagonally=False, owner=None, hit_box=None):
+    """
+    An arcade.Sprite showing an image, with its texture from the shared
+    cache, and the sprite itself from the shared sprite_pool. Its hit box
+    is hit_box if given, otherwise the image's, from hitbox_cache.
+    """
+    texture = cache.texture(image_file,
+                            flipped_horizontally=flipped_horizontally,
+                            flipped_vertically=flipped_vertically,
+                            flipped_diagonally=flipped_diagonally,
+                            owner=owner)
+    sprite = sprite_pool.pool.sprite(texture, scale)
+    if hit_box is None:
+        hit_box = hitbox_cache.hit_boxes.points(image_file, texture.image,
+                                                flipped_horizontally, flipped_vertically,
+                                                flipped_diagonally)
+    sprite.set_hit_box(hit_box)
+    return sprite
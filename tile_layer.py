@@ -0,0 +1,172 @@
+"""
+Compact static tile layers
+
+A layer built by process_layer() is one arcade.Sprite per tile, each a
+Python object with dozens of attributes, when a tile that never moves only
+needs a position and a texture. A TileLayer keeps a layer as a few NumPy
+arrays instead, around ten bytes a tile: centers, and an index into a
+short table of the distinct (image, flips) the layer uses.
+
+It can be baked into chunks (see placements()), collided against with
+batch_collision, and any tile the game needs as a real sprite can be
+promoted to one with sprite().
+"""
+import arcade
+import numpy
+
+import batch_collision
+import level_cache
+import texture_cache
+
+
+class TileLayer:
+    """ The tiles of one layer of a level_cache.CompiledLevel, stored as arrays. """
+
+    def __init__(self, level, layer_name, scaling=1, owner=None):
+        self.name = layer_name
+        self.scaling = scaling
+
+        # Holds the layer's textures in texture_cache
+        self.owner = owner
+
+        # Texture index -> (image file, flipped horizontally, vertically, diagonally)
+        self.texture_keys = []
+        # Texture index -> (width, height) as drawn
+        self.texture_sizes = []
+        # Texture index -> hit box drawn in the tileset, or None
+        self.texture_hit_boxes = []
+        # Texture index -> arcade.Texture, loaded on first use
+        self.textures = {}
+
+        # Tile index -> sprite, for the tiles promoted so far
+        self.promoted = {}
+
+        layer = level.get_layer(layer_name)
+        if layer is None:
+            print(f"Warning, no layer named '{layer_name}'.")
+            gids = []
+            layer_width = 1
+            self.alpha = 255
+        else:
+            gids = layer.gids
+            layer_width = layer.width
+            self.alpha = int(layer.opacity * 255) if layer.opacity < 1 else 255
+
+        tile_width = level.tile_width * scaling
+        tile_height = level.tile_height * scaling
+        texture_indexes = {}
+        centers_x = []
+        centers_y = []
+        tile_textures = []
+
+        for index, gid in enumerate(gids):
+            if gid == 0:
+                continue
+
+            tile = level.tiles.get(gid & level_cache.GID_MASK)
+            if tile is None:
+                raise ValueError(f"Warning, couldn't find tile for item {gid} in layer "
+                                 f"'{layer_name}' in file '{level.source}'.")
+
+            flags = gid & ~level_cache.GID_MASK
+            texture_index = texture_indexes.get((tile[0], flags))
+            if texture_index is None:
+                texture_index = len(self.texture_keys)
+                texture_indexes[(tile[0], flags)] = texture_index
+                flipped_diagonally = bool(flags & level_cache.FLIPPED_DIAGONALLY_FLAG)
+                self.texture_keys.append((tile[0],
+                                          bool(flags & level_cache.FLIPPED_HORIZONTALLY_FLAG),
+                                          bool(flags & level_cache.FLIPPED_VERTICALLY_FLAG),
+                                          flipped_diagonally))
+                # A diagonal flip turns the image on its side
+                image_width, image_height = tile[1], tile[2]
+                if flipped_diagonally:
+                    image_width, image_height = image_height, image_width
+                self.texture_sizes.append((image_width * scaling, image_height * scaling))
+                self.texture_hit_boxes.append(level.hit_boxes.get(gid & level_cache.GID_MASK))
+
+            width, height = self.texture_sizes[texture_index]
+            row, column = divmod(index, layer_width)
+            # Placed the same way as process_layer() places sprites
+            centers_x.append(column * tile_width + width / 2)
+            centers_y.append((level.map_height - row - 1) * tile_height + height / 2)
+            tile_textures.append(texture_index)
+
+        self.center_x = numpy.array(centers_x, dtype=numpy.float32)
+        self.center_y = numpy.array(centers_y, dtype=numpy.float32)
+        self.texture_index = numpy.array(tile_textures, dtype=numpy.uint16)
+
+        self._boxes = None
+
+    def __len__(self):
+        return len(self.texture_index)
+
+    def texture(self, texture_index):
+        """ The arcade.Texture for a texture index, loaded the same way a sprite would load it. """
+        texture = self.textures.get(texture_index)
+        if texture is None:
+            image_file, flipped_horizontally, flipped_vertically, flipped_diagonally = \
+                self.texture_keys[texture_index]
+            texture = texture_cache.cache.texture(image_file,
+                                                  flipped_horizontally=flipped_horizontally,
+                                                  flipped_vertically=flipped_vertically,
+                                                  flipped_diagonally=flipped_diagonally,
+                                                  owner=self.owner)
+            self.textures[texture_index] = texture
+        return texture
+
+    def boxes(self):
+        """ An (n, 4) array of every tile's left, right, bottom, top. """
+        if self._boxes is None:
+            sizes = numpy.array(self.texture_sizes, dtype=numpy.float64).reshape(-1, 2)
+            half_width = sizes[self.texture_index, 0] / 2
+            half_height = sizes[self.texture_index, 1] / 2
+            self._boxes = numpy.column_stack((self.center_x - half_width,
+                                              self.center_x + half_width,
+                                              self.center_y - half_height,
+                                              self.center_y + half_height))
+        return self._boxes
+
+    def collide(self, actor_boxes):
+        """ (actor index, tile index) pairs of overlapping boxes, see batch_collision. """
+        return batch_collision.collide_boxes(actor_boxes, self.boxes())
+
+    def tiles_in(self, left, right, bottom, top):
+        """ Indexes of the tiles overlapping a rectangle. """
+        return self.collide([(left, right, bottom, top)])[:, 1]
+
+    def placements(self):
+        """ (texture, width, height, alpha, center x, center y) of every tile, for baking. """
+        for index in range(len(self)):
+            texture_index = int(self.texture_index[index])
+            width, height = self.texture_sizes[texture_index]
+            yield (self.texture(texture_index), width, height, self.alpha,
+                   float(self.center_x[index]), float(self.center_y[index]))
+
+    def sprite(self, index):
+        """ The tile as a real arcade.Sprite, made the first time it's asked for. """
+        sprite = self.promoted.get(index)
+        if sprite is None:
+            texture_index = int(self.texture_index[index])
+            image_file, flipped_horizontally, flipped_vertically, flipped_diagonally = \
+                self.texture_keys[texture_index]
+            sprite = texture_cache.make_sprite(image_file, self.scaling,
+                                               flipped_horizontally,
+                                               flipped_vertically,
+                                               flipped_diagonally,
+                                               owner=self.owner,
+                                               hit_box=self.texture_hit_boxes[texture_index])
+            sprite.center_x = float(self.center_x[index])
+            sprite.center_y = float(self.center_y[index])
+            if self.alpha != 255:
+                sprite.alpha = self.alpha
+            self.promoted[index] = sprite
+        return sprite
+
+    def sprite_list(self, indexes=None, use_spatial_hash=None):
+        """ A SpriteList of promoted tiles: the given indexes, or the whole layer. """
+        if indexes is None:
+            indexes = range(len(self))
+        sprite_list = arcade.SpriteList(use_spatial_hash=use_spatial_hash)
+        sprite_list.extend(self.sprite(int(index)) for index in indexes)
+        return sprite_list
@@ -0,0 +1,43 @@
+"""
+Fixed timestep scheduling
+
+Frames arrive at whatever rate the machine manages. FixedTimestep turns
+those uneven frame times into a whole number of equal physics steps, and
+keeps the time left over so the renderer can blend between the last two
+steps.
+"""
+
+# Never run more than this many steps for one frame. After a long stall
+# (window dragged, level loading) the game skips ahead instead of trying
+# to catch up and falling further behind.
+MAX_STEPS_PER_FRAME = 5
+
+
+class FixedTimestep:
+    """ Accumulates frame time and hands it out in fixed-size steps. """
+
+    def __init__(self, rate, max_steps=MAX_STEPS_PER_FRAME):
+        self.rate = rate
+        self.step_time = 1 / rate
+        self.max_steps = max_steps
+        self.accumulator = 0.0
+
+    def advance(self, delta_time):
+        """ Add a frame's worth of time, and return how many steps to run for it. """
+        self.accumulator += delta_time
+        steps = int(self.accumulator // self.step_time)
+        if steps > self.max_steps:
+            steps = self.max_steps
+            self.accumulator %= self.step_time
+        else:
+            self.accumulator -= steps * self.step_time
+        return steps
+
+    @property
+    def alpha(self):
+        """ How far, from 0 to 1, the current frame is between the last step and the next. """
+        return min(self.accumulator / self.step_time, 1.0)
+
+    def reset(self):
+        """ Forget any time left over. """
+        self.accumulator = 0.0